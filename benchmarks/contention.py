@@ -0,0 +1,98 @@
+# Author : Joinemm
+# File   : benchmarks/contention.py
+
+"""Stress test of spawning and claiming under concurrent messages.
+
+Every round, thousands of users answer the same question at once and exactly one
+of them must be rewarded. Then a flood of chatter must spawn exactly one question
+per threshold crossing. Exits with status 1 if either is broken.
+
+    python benchmarks/contention.py [answers per round] [rounds]
+"""
+
+import asyncio
+import contextlib
+import io
+import sys
+import time
+
+import fakes
+
+fakes.sandbox()
+
+import game  # noqa: E402
+import matcher  # noqa: E402
+
+THRESHOLD = 50
+
+
+def rewarded(users):
+    return sum(game.database.get_inventory(user).total() for user in users)
+
+
+async def answer_round(cog, channel, users):
+    state = cog.spawns.get(channel.guild.id)
+    cog.spawn_question(channel, state)
+    answer = matcher.split_answers(state.current_question['answer'])[0]
+    # every other message is a wrong guess, so claims and misses interleave
+    messages = [fakes.FakeMessage(answer if i % 2 == 0 else "nope", user, channel) for i, user in enumerate(users)]
+    before = rewarded(users)
+    await asyncio.gather(*(cog.on_message(message) for message in messages))
+    return rewarded(users) - before
+
+
+async def chatter(cog, channel, user, amount):
+    state = cog.spawns.get(channel.guild.id)
+    start_round = state.round
+    # questions nobody will answer, so every message counts towards the next spawn
+    messages = [fakes.FakeMessage(f"chatter {i}", user, channel) for i in range(amount)]
+    await asyncio.gather(*(cog.on_message(message) for message in messages))
+    return state.round - start_round
+
+
+def main(per_round, rounds):
+    bot = fakes.FakeBot()
+    cog = game.Game(bot)
+    # no spawns while answering, a new round mid-flood could rightly reward a second user
+    cog.new_threshold = lambda guild_id: float("inf")
+    cog.spawns.new_threshold = cog.new_threshold
+
+    guild = fakes.FakeGuild()
+    channel = guild.channels[0]
+    game.database.change_guild_setting(guild.id, "channel", channel.id)
+    users = [fakes.FakeUser() for _ in range(per_round)]
+
+    failures = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [bot.loop.run_until_complete(answer_round(cog, channel, users)) for _ in range(rounds)]
+    elapsed = time.perf_counter() - start
+    wrong = [r for r in results if r != 1]
+    print(f"{rounds} rounds of {per_round} simultaneous answers in {elapsed:.2f}s, "
+          f"rewards per round: {sorted(set(results))}")
+    if wrong:
+        print(f"FAIL: {len(wrong)} rounds did not reward exactly one user")
+        failures += 1
+
+    amount = per_round * rounds
+    state = cog.spawns.get(guild.id)
+    state.counter, state.threshold = 0, THRESHOLD
+    cog.new_threshold = lambda guild_id: THRESHOLD
+    start = time.perf_counter()
+    spawned = bot.loop.run_until_complete(chatter(cog, channel, users[0], amount))
+    elapsed = time.perf_counter() - start
+    expected = amount // (THRESHOLD + 1)
+    print(f"{amount} simultaneous messages in {elapsed:.2f}s spawned {spawned} questions, expected {expected}")
+    if spawned != expected:
+        print("FAIL: duplicate or missing spawns")
+        failures += 1
+
+    # let the outbox drain before the loop goes away
+    bot.loop.run_until_complete(asyncio.sleep(0.1))
+    print("OK" if not failures else "FAILED")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    sys.exit(main(*(args + [5000, 20][len(args):])))
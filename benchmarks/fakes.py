@@ -0,0 +1,180 @@
+# Author : Joinemm
+# File   : benchmarks/fakes.py
+
+"""Minimal stand-ins for the discord objects the cogs touch, so hot paths can be
+timed without a bot token or a network connection."""
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_ids = itertools.count(1000)
+
+
+def sandbox(data_file=None):
+    """Switch to a scratch directory holding a copy of the data file and a link to img/,
+    so benchmarks never touch the real data. Must run before importing game or database.
+    :returns path of the scratch directory"""
+    workdir = tempfile.mkdtemp(prefix="collector-bench-")
+    shutil.copy(data_file or os.path.join(REPO_ROOT, "data.json"), os.path.join(workdir, "data.json"))
+    os.symlink(os.path.join(REPO_ROOT, "img"), os.path.join(workdir, "img"))
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return workdir
+
+
+def synthetic_sandbox(users, cards, per_user, questions=200, seed=0):
+    """Like sandbox, but with a generated data.json of [users] users owning [per_user] of
+    [cards] cards each, and an image folder of [cards] links to a real image.
+    :returns path of the scratch directory"""
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="collector-load-")
+    source = os.path.join(REPO_ROOT, "img", "10", "hye.jpg")
+    paths = []
+    for i in range(cards):
+        tier = rng.choice((1, 5, 10, 20, 50))
+        directory = os.path.join(workdir, "img", str(tier))
+        os.makedirs(directory, exist_ok=True)
+        os.symlink(source, os.path.join(directory, f"card-{i:05d}.jpg"))
+        paths.append(f"img/{tier}/card-{i:05d}.jpg")
+
+    data = {
+        "settings": {},
+        "quotes": [{"question": f"Question number {i}?", "answer": f"answer {i}"} for i in range(questions)],
+        "whitelist": [],
+        "cards": paths,
+        "users": {},
+    }
+    for userid in range(10 ** 17, 10 ** 17 + users):
+        owned = sorted(rng.sample(range(cards), min(per_user, cards)))
+        data['users'][str(userid)] = owned + [rng.randint(1, 5) for _ in owned]
+    with open(os.path.join(workdir, "data.json"), "w") as f:
+        json.dump(data, f, separators=(',', ':'))
+
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return workdir
+
+
+class FakeUser:
+
+    def __init__(self, user_id=None, name="user", bot=False):
+        self.id = user_id if user_id is not None else next(_ids)
+        self.name = name
+        self.discriminator = "0001"
+        self.bot = bot
+        self.mention = f"<@{self.id}>"
+
+
+class FakeMessage:
+
+    def __init__(self, content, author, channel):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = getattr(channel, "guild", None)
+        self.embeds = []
+        self.attachments = []
+        self.reactions = []
+        self.edits = 0
+
+    async def add_reaction(self, emoji):
+        self.reactions.append(emoji)
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def edit(self, content=None, embed=None, **kwargs):
+        if self.channel.latency:
+            await asyncio.sleep(self.channel.latency)
+        self.edits += 1
+        if embed is not None:
+            self.embeds = [embed]
+
+
+class FakeAttachment:
+
+    def __init__(self, filename):
+        self.id = next(_ids)
+        self.filename = filename
+        self.url = f"https://cdn.example.invalid/attachments/{self.id}/{filename}"
+
+
+class FakeChannel:
+
+    def __init__(self, guild=None, channel_id=None):
+        self.id = channel_id if channel_id is not None else next(_ids)
+        self.guild = guild
+        self.mention = f"<#{self.id}>"
+        self.sent = 0
+        # seconds every request takes, to stand in for the round trip to discord
+        self.latency = 0.0
+
+    async def send(self, content=None, embed=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        message = FakeMessage(content, None, self)
+        if embed is not None:
+            message.embeds = [embed]
+        if kwargs.get("file") is not None:
+            message.attachments = [FakeAttachment(kwargs["file"].filename)]
+        return message
+
+
+class FakeGuild:
+
+    def __init__(self, guild_id=None, channels=1):
+        self.id = guild_id if guild_id is not None else next(_ids)
+        self.channels = [FakeChannel(self) for _ in range(channels)]
+
+    def get_channel(self, channel_id):
+        for channel in self.channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+
+class FakeContext:
+
+    def __init__(self, bot, author, channel):
+        self.bot = bot
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.message = FakeMessage("", author, channel)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeReactionPayload:
+
+    def __init__(self, message, user, emoji):
+        self.message_id = message.id
+        self.channel_id = message.channel.id
+        self.user_id = user.id
+        self.emoji = emoji
+
+
+class FakeBot:
+
+    def __init__(self, command_prefix="q!", loop=None):
+        self.command_prefix = command_prefix
+        self.loop = loop or asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.user = FakeUser(name="bot", bot=True)
+        self.users = {}
+
+    def get_user(self, user_id):
+        return self.users.get(user_id)
@@ -0,0 +1,155 @@
+# Author : Joinemm
+# File   : benchmarks/loadtest.py
+
+"""Replay synthetic chat traffic through the real Game cog and report throughput,
+handler latency, data file writes and memory.
+
+    python benchmarks/loadtest.py --users 10000 --cards 500 --rate 2000 --seconds 10
+
+Traffic is a mix of chatter, answers to the open question, inventory and leaderboard
+commands, and reaction clicks on the menus those commands opened. With --rate 0 the
+events are replayed as fast as the loop takes them."""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import resource
+import sys
+import time
+
+import fakes
+
+# event kind -> share of the traffic
+MIX = {
+    "chatter": 0.80,
+    "answer": 0.10,
+    "inventory": 0.03,
+    "leaderboard": 0.02,
+    "reaction": 0.05,
+}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Traffic:
+
+    def __init__(self, cog, guilds, users, seed=0):
+        self.cog = cog
+        self.guilds = guilds
+        self.users = users
+        self.rng = random.Random(seed)
+        self.kinds = list(MIX)
+        self.weights = list(MIX.values())
+        self.menus = []
+        self.latencies = dict((kind, []) for kind in MIX)
+
+    async def event(self, kind):
+        rng = self.rng
+        guild = rng.choice(self.guilds)
+        channel = guild.channels[0]
+        user = rng.choice(self.users)
+        start = time.perf_counter()
+
+        if kind == "chatter":
+            await self.cog.on_message(fakes.FakeMessage(f"hello {rng.random()}", user, channel))
+        elif kind == "answer":
+            question = self.cog.spawns.get(guild.id).current_question
+            content = question['answer'].split('|')[0] if question is not None else "no idea"
+            await self.cog.on_message(fakes.FakeMessage(content, user, channel))
+        elif kind in ("inventory", "leaderboard"):
+            ctx = fakes.FakeContext(self.cog.client, user, channel)
+            sent = channel.sent
+            await getattr(self.cog, kind).callback(self.cog, ctx)
+            if channel.sent > sent and self.cog.menus.menus:
+                self.menus.append((next(reversed(self.cog.menus.menus.values())).message, user))
+                del self.menus[:-100]
+        elif kind == "reaction":
+            if not self.menus:
+                return
+            message, owner = rng.choice(self.menus)
+            emoji = rng.choice(("⬅", "➡"))
+            await self.cog.on_raw_reaction_add(fakes.FakeReactionPayload(message, owner, emoji))
+
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    async def replay(self, rate, seconds):
+        """Fire events on an open-loop schedule of [rate] per second for [seconds]
+        :returns (events fired, wall time)"""
+        loop = asyncio.get_event_loop()
+        total = int(rate * seconds) if rate else int(seconds * 10000)
+        kinds = self.rng.choices(self.kinds, self.weights, k=total)
+        tasks = []
+        start = loop.time()
+        for i, kind in enumerate(kinds):
+            if rate:
+                delay = start + i / rate - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(loop.create_task(self.event(kind)))
+            if len(tasks) >= 1000:
+                await asyncio.gather(*tasks)
+                tasks = []
+        await asyncio.gather(*tasks)
+        return total, loop.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the Game cog")
+    parser.add_argument("--users", type=int, default=10000, help="users in the generated data.json")
+    parser.add_argument("--cards", type=int, default=500, help="cards in the generated image folder")
+    parser.add_argument("--per-user", type=int, default=20, help="cards owned by each user")
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--active", type=int, default=1000, help="users sending the traffic")
+    parser.add_argument("--rate", type=float, default=2000, help="events per second, 0 for as fast as possible")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each fake discord request takes")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fakes.synthetic_sandbox(args.users, args.cards, args.per_user, seed=args.seed)
+    start = time.perf_counter()
+    import game
+    load_time = time.perf_counter() - start
+
+    bot = fakes.FakeBot()
+    cog = game.Game(bot)
+    storage = game.database.storage
+    rng = random.Random(args.seed)
+    guilds = [fakes.FakeGuild() for _ in range(args.guilds)]
+    for guild in guilds:
+        guild.channels[0].latency = args.latency
+    users = [fakes.FakeUser(user_id=10 ** 17 + rng.randrange(args.users)) for _ in range(args.active)]
+
+    traffic = Traffic(cog, guilds, users, seed=args.seed)
+    flusher_writes = getattr(storage, "writes", 0)
+    saves = getattr(storage, "generation", 0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        events, elapsed = bot.loop.run_until_complete(traffic.replay(args.rate, args.seconds))
+        # let queued sends and the last write finish
+        bot.loop.run_until_complete(asyncio.sleep(max(0.5, args.latency * 10)))
+    queue = cog.outbox.stats()
+    cog.cog_unload()
+
+    print(f"{args.users} users, {args.cards} cards, {args.guilds} guilds, data loaded in {load_time:.2f}s")
+    target = f" (target {args.rate:.0f}/s)" if args.rate else ""
+    print(f"{events} events in {elapsed:.2f}s, {events / elapsed:.0f} events/s{target}")
+    print(f"{'event':<12} {'count':>8} {'p50 us':>10} {'p99 us':>10} {'max us':>10}")
+    for kind, latencies in traffic.latencies.items():
+        latencies.sort()
+        print(f"{kind:<12} {len(latencies):>8} {percentile(latencies, 0.5) * 1e6:>10.0f} "
+              f"{percentile(latencies, 0.99) * 1e6:>10.0f} {(latencies[-1] if latencies else 0) * 1e6:>10.0f}")
+    print(f"saves {getattr(storage, 'generation', 0) - saves}, "
+          f"file writes {getattr(storage, 'writes', 0) - flusher_writes}")
+    print(f"send queue: {queue['sent']} sent, {queue['coalesced']} coalesced, "
+          f"wait p50 {queue['wait_p50'] * 1000:.1f}ms p99 {queue['wait_p99'] * 1000:.1f}ms")
+    print(f"max rss {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# Author : Joinemm
+# File   : benchmarks/memory.py
+
+"""Memory and file size of inventories keyed by path strings versus card ids.
+
+    python benchmarks/memory.py [users] [cards] [cards per user]
+"""
+
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import fakes
+
+fakes.sandbox()
+
+import storage  # noqa: E402
+
+
+def generate(users, cards, per_user, seed=0):
+    """:returns data.json contents in the layout from before card ids"""
+    rng = random.Random(seed)
+    paths = [f"img/{rng.choice((1, 5, 10, 20, 50))}/card-{i:05d}.jpg" for i in range(cards)]
+    data = {"settings": {}, "quotes": [], "whitelist": [], "users": {}}
+    for userid in range(10 ** 17, 10 ** 17 + users):
+        owned = rng.sample(paths, min(per_user, cards))
+        data['users'][str(userid)] = dict((path, rng.randint(1, 5)) for path in owned)
+    return data
+
+
+def measure(load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def load_paths(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def main(users, cards, per_user):
+    with open("paths.json", "w") as f:
+        # the format Database saved in before card ids
+        f.write(json.dumps(generate(users, cards, per_user)))
+
+    converted = storage.JSONStorage("paths.json")
+    with open("ids.json", "w") as f:
+        f.write(converted._serialize())
+    del converted
+
+    old, old_memory, old_time = measure(lambda: load_paths("paths.json"))
+    del old
+    new, new_memory, new_time = measure(lambda: storage.JSONStorage("ids.json"))
+    del new
+
+    print(f"{users} users, {cards} cards, {per_user} cards per user")
+    print(f"{'layout':<12} {'file MB':>9} {'memory MB':>10} {'load s':>8}")
+    for name, filename, memory, elapsed in (("paths", "paths.json", old_memory, old_time),
+                                            ("card ids", "ids.json", new_memory, new_time)):
+        print(f"{name:<12} {os.path.getsize(filename) / 1e6:9.1f} {memory / 1e6:10.1f} {elapsed:8.2f}")
+    print(f"file {os.path.getsize('paths.json') / os.path.getsize('ids.json'):.1f}x smaller, "
+          f"memory {old_memory / new_memory:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [100000, 500, 20][len(args):]))
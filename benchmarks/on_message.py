@@ -0,0 +1,59 @@
+# Author : Joinemm
+# File   : benchmarks/on_message.py
+
+"""Per-message cost of Game.on_message for the kinds of traffic a busy guild sees.
+
+    python benchmarks/on_message.py [messages]
+"""
+
+import sys
+import time
+
+import fakes
+
+fakes.sandbox()
+
+import game  # noqa: E402
+
+
+def run(cog, messages):
+    async def handle_all():
+        for message in messages:
+            await cog.on_message(message)
+
+    start = time.perf_counter()
+    cog.client.loop.run_until_complete(handle_all())
+    return (time.perf_counter() - start) / len(messages) * 1e9
+
+
+def main(amount):
+    bot = fakes.FakeBot()
+    cog = game.Game(bot)
+    # no spawns during the measurement
+    cog.spawns.new_threshold = lambda guild_id: float("inf")
+
+    guild = fakes.FakeGuild(channels=2)
+    game_channel, other_channel = guild.channels
+    game.database.change_guild_setting(guild.id, "channel", game_channel.id)
+    human = fakes.FakeUser()
+    bot_user = fakes.FakeUser(bot=True)
+
+    cases = [
+        ("bot author", fakes.FakeMessage("beep", bot_user, game_channel)),
+        ("direct message", fakes.FakeMessage("hello", human, fakes.FakeChannel())),
+        ("command", fakes.FakeMessage("q!inventory", human, game_channel)),
+        ("other channel", fakes.FakeMessage("hello", human, other_channel)),
+        ("game channel", fakes.FakeMessage("hello", human, game_channel)),
+    ]
+    print(f"{'message':<16} {'ns/message':>12}")
+    for name, message in cases:
+        try:
+            cost = run(cog, [message] * amount)
+        except AttributeError:
+            print(f"{name:<16} {'crashes':>12}")
+            continue
+        print(f"{name:<16} {cost:12.0f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
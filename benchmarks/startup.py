@@ -0,0 +1,102 @@
+# Author : Joinemm
+# File   : benchmarks/startup.py
+
+"""Time until the database is ready, and peak memory, of the json and lazy backends.
+
+    python benchmarks/startup.py [users ...] [--cards 500] [--per-user 20]
+
+Every start runs in a fresh process so the memory is its own. The lazy backend gets
+a copy of the same data.json, converted once before it is timed."""
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import time
+
+import fakes
+
+BACKENDS = ("json", "lazy")
+
+
+def child(kind, users, reads):
+    """Start the database in this directory and print seconds until ready,
+    seconds per first inventory read, and max rss in kB"""
+    sys.path.insert(0, fakes.REPO_ROOT)
+    start = time.perf_counter()
+    import database
+    import storage
+    db = database.Database(storage.open_storage(kind))
+    ready = time.perf_counter() - start
+
+    # synthetic_sandbox numbers the users from 10 ** 17
+    userids = random.Random(0).sample(range(10 ** 17, 10 ** 17 + users), min(reads, users))
+    start = time.perf_counter()
+    for userid in userids:
+        db.storage.get_inventory(str(userid))
+    first_read = (time.perf_counter() - start) / max(1, len(userids))
+    print(ready, first_read, peak_rss())
+
+
+def peak_rss():
+    """:returns max rss of this process in kB. ru_maxrss carries over the parent's peak
+    through exec, so on linux read the one of this address space"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def start(kind, workdir, users, reads):
+    """:returns (seconds until ready, seconds per first read, max rss in kB) of a fresh process"""
+    command = [sys.executable, os.path.abspath(__file__), str(users),
+               "--child", kind, "--reads", str(reads)]
+    output = subprocess.run(command, cwd=workdir, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    ready, first_read, rss = output.split()[-3:]
+    return float(ready), float(first_read), int(rss)
+
+
+def files_size(workdir):
+    return sum(os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)
+               if name == "data.json" or name.startswith("users"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time and memory of the storage backends")
+    parser.add_argument("users", type=int, nargs="*", default=[10000, 100000, 1000000])
+    parser.add_argument("--cards", type=int, default=500)
+    parser.add_argument("--per-user", type=int, default=20)
+    parser.add_argument("--reads", type=int, default=1000, help="inventories read once ready")
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child, args.users[0], args.reads)
+
+    print(f"{'users':>8} {'backend':<8} {'files MB':>9} {'ready s':>8} {'read us':>8} {'max rss MB':>11}")
+    for users in args.users:
+        workdir = fakes.synthetic_sandbox(users, args.cards, args.per_user)
+        lazydir = os.path.join(workdir, "lazy")
+        os.mkdir(lazydir)
+        shutil.copy(os.path.join(workdir, "data.json"), lazydir)
+        os.symlink(os.path.join(workdir, "img"), os.path.join(lazydir, "img"))
+        # the first start splits the inventories out of data.json
+        start("lazy", lazydir, users, 0)
+
+        for kind, directory in (("json", workdir), ("lazy", lazydir)):
+            ready, first_read, rss = start(kind, directory, users, args.reads)
+            print(f"{users:>8} {kind:<8} {files_size(directory) / 1e6:9.1f} {ready:8.2f} "
+                  f"{first_read * 1e6:8.1f} {rss / 1024:11.1f}")
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
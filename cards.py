@@ -0,0 +1,138 @@
+# Author : Joinemm
+# File   : cards.py
+
+from array import array
+from bisect import bisect_left
+
+
+class CardRegistry:
+    """Gives every image path a small integer id, so inventories store ids
+    and the path string exists only once.
+
+    on_add  : function(card_id, path) called when a new path is registered,
+              may return a different id to use, e.g. one the database assigned
+    on_miss : function(card_id) returning the path of an id this registry doesn't know,
+              for ids registered by another process sharing the database"""
+
+    def __init__(self, paths=None, on_add=None, on_miss=None):
+        self.paths = {}
+        self.ids = {}
+        self.next_id = 0
+        self.on_add = on_add
+        self.on_miss = on_miss
+        self.load((paths or {}).items())
+
+    def load(self, rows):
+        """Register (card_id, path) pairs that are already stored"""
+        for card_id, path in rows:
+            self.paths[card_id] = path
+            self.ids[path] = card_id
+            self.next_id = max(self.next_id, card_id + 1)
+
+    def id(self, path):
+        """Get the id of a path, registering it if it's new"""
+        card_id = self.ids.get(path)
+        if card_id is None:
+            card_id = self.next_id
+            if self.on_add is not None:
+                assigned = self.on_add(card_id, path)
+                if assigned is not None:
+                    card_id = assigned
+            self.load([(card_id, path)])
+        return card_id
+
+    def get_id(self, path):
+        """Get the id of a path or None if it was never registered"""
+        return self.ids.get(path)
+
+    def path(self, card_id):
+        try:
+            return self.paths[card_id]
+        except KeyError:
+            if self.on_miss is None:
+                raise
+            path = self.on_miss(card_id)
+            if path is None:
+                raise
+            self.load([(card_id, path)])
+            return path
+
+    def __len__(self):
+        return len(self.paths)
+
+
+class Inventory(array):
+    """Card id -> amount of one user in a single flat array: the sorted card ids
+    followed by their amounts, [id0, id1, ..., amount0, amount1, ...]"""
+
+    __slots__ = ()
+
+    def __new__(cls, pairs=()):
+        pairs = sorted(pairs)
+        return super().__new__(cls, 'I', [card_id for card_id, _ in pairs] + [amount for _, amount in pairs])
+
+    @classmethod
+    def from_list(cls, flat):
+        """Build from the list to_list returned"""
+        return array.__new__(cls, 'I', flat)
+
+    def to_list(self):
+        """:returns [id0, id1, ..., amount0, amount1, ...]"""
+        return self.tolist()
+
+    def _index(self, card_id):
+        n = len(self)
+        i = bisect_left(self, card_id, 0, n)
+        if i < n and array.__getitem__(self, i) == card_id:
+            return i
+        return None
+
+    def get(self, card_id, default=0):
+        i = self._index(card_id)
+        return default if i is None else array.__getitem__(self, len(self) + i)
+
+    def add(self, card_id, amount=1):
+        n = len(self)
+        i = bisect_left(self, card_id, 0, n)
+        if i < n and array.__getitem__(self, i) == card_id:
+            array.__setitem__(self, n + i, array.__getitem__(self, n + i) + amount)
+        else:
+            self.insert(n + i, amount)
+            self.insert(i, card_id)
+
+    def remove(self, card_id, amount=None):
+        """Remove [amount] of a card, or all of it if amount is None
+        :returns how many were removed"""
+        i = self._index(card_id)
+        if i is None:
+            return 0
+        n = len(self)
+        owned = array.__getitem__(self, n + i)
+        if amount is None or amount >= owned:
+            array.__delitem__(self, n + i)
+            array.__delitem__(self, i)
+            return owned
+        array.__setitem__(self, n + i, owned - amount)
+        return amount
+
+    def items(self):
+        n = len(self)
+        return zip(array.__getitem__(self, slice(0, n)), array.__getitem__(self, slice(n, None)))
+
+    def total(self):
+        return sum(array.__getitem__(self, slice(len(self), None)))
+
+    def __contains__(self, card_id):
+        return self._index(card_id) is not None
+
+    def __iter__(self):
+        return iter(array.__getitem__(self, slice(0, len(self))))
+
+    def __len__(self):
+        return array.__len__(self) // 2
+
+    def __eq__(self, other):
+        return isinstance(other, Inventory) and array.__eq__(self, other)
+
+    def __repr__(self):
+        return f"Inventory({dict(self.items())})"
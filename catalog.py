@@ -0,0 +1,142 @@
+# Author : Joinemm
+# File   : catalog.py
+
+import bisect
+import os
+import time
+
+
+IMAGE_ROOT = "img"
+# how often at most the folder mtimes are checked for changes, in seconds
+REFRESH_INTERVAL = 30.0
+# folders holding images of retired cards, owned cards whose file is gone are looked up here
+REFERENCE_FOLDERS = ("reference", "Reference")
+
+_names = {}
+
+
+def card_name(path):
+    """Display name of a card, img/10/hye.jpg -> hye. Parsed once per path."""
+    name = _names.get(path)
+    if name is None:
+        name = '.'.join(path.split('/')[-1].split('.')[:-1])
+        _names[path] = name
+    return name
+
+
+class ImageCatalog:
+    """In-memory listing of the reward images.
+
+    Every numeric folder under the image root is a rarity tier weighted by its name,
+    e.g. img/10/ is drawn twice as often as img/5/. The listing is rebuilt only when
+    the mtime of the root or of a tier folder changes, or when refresh() is called."""
+
+    def __init__(self, root=IMAGE_ROOT, refresh_interval=REFRESH_INTERVAL):
+        self.root = root
+        self.refresh_interval = refresh_interval
+        self.tiers = []
+        self.weights = []
+        self.folders = {}
+        # every known image path, filename -> path in the reference folders,
+        # and filename -> path anywhere with tier folders winning over references
+        self.paths = frozenset()
+        self.references = {}
+        self.filenames = {}
+        # casefolded card name -> paths with that name, tier folders before references,
+        # and every casefolded name in sorted order for prefix searches
+        self.names = {}
+        self.sorted_names = []
+        self.mtimes = {}
+        self.last_check = 0.0
+        # bumped on every rescan so dependent structures know to rebuild
+        self.version = 0
+        self.refresh()
+
+    def refresh(self):
+        """Rescan the image folders"""
+        mtimes = {self.root: os.stat(self.root).st_mtime}
+        folders = {}
+        for name in os.listdir(self.root):
+            try:
+                int(name)
+            except ValueError:
+                continue
+            directory = f"{self.root}/{name}"
+            mtimes[directory] = os.stat(directory).st_mtime
+            files = sorted(os.listdir(directory))
+            if files:
+                folders[name] = [f"{directory}/{filename}" for filename in files]
+
+        references = {}
+        for name in reversed(REFERENCE_FOLDERS):
+            directory = f"{self.root}/{name}"
+            if not os.path.isdir(directory):
+                continue
+            mtimes[directory] = os.stat(directory).st_mtime
+            for filename in os.listdir(directory):
+                references[filename] = f"{directory}/{filename}"
+
+        self.tiers = sorted(folders, key=int)
+        self.weights = [int(tier) for tier in self.tiers]
+        self.folders = folders
+        self.references = references
+        self.paths = frozenset(path for files in folders.values() for path in files) | frozenset(references.values())
+        filenames = dict(references)
+        for tier in self.tiers:
+            for path in folders[tier]:
+                filenames[path.split('/')[-1]] = path
+        self.filenames = filenames
+        names = {}
+        for path in [path for tier in self.tiers for path in folders[tier]] + sorted(references.values()):
+            names.setdefault(card_name(path).casefold(), []).append(path)
+        self.names = names
+        self.sorted_names = sorted(names)
+        self.mtimes = mtimes
+        self.last_check = time.monotonic()
+        self.version += 1
+
+    def is_stale(self):
+        """Check if any folder changed since the last scan"""
+        try:
+            return any(os.stat(directory).st_mtime != mtime for directory, mtime in self.mtimes.items())
+        except FileNotFoundError:
+            return True
+
+    def check(self):
+        """Rescan if the folders changed, at most once per refresh interval"""
+        now = time.monotonic()
+        if now - self.last_check < self.refresh_interval:
+            return
+        self.last_check = now
+        if self.is_stale():
+            self.refresh()
+
+    def exists(self, path):
+        """Check if an image exists without touching the disk"""
+        self.check()
+        return path in self.paths
+
+    def find(self, name):
+        """:returns paths of every image called [name], ignoring case"""
+        self.check()
+        return self.names.get(name.casefold(), ())
+
+    def search(self, prefix):
+        """Yield (casefolded name, paths) of every card whose name starts with [prefix],
+        ignoring case, in name order"""
+        self.check()
+        prefix = prefix.casefold()
+        names = self.sorted_names
+        i = bisect.bisect_left(names, prefix)
+        while i < len(names) and names[i].startswith(prefix):
+            yield names[i], self.names[names[i]]
+            i += 1
+
+    def relocate(self, path):
+        """Where an image that is gone has moved to
+        :returns path of the image with the same filename, looking in the tier folders
+                 before the reference folders, or None"""
+        return self.filenames.get(path.split('/')[-1])
+
+    def __len__(self):
+        return sum(len(files) for files in self.folders.values())
@@ -1,194 +1,279 @@
 # Author : Joinemm
 # File   : database.py
 
-import json
-import os
-import random
-import copy
-
-
-""" DATABASE STRUCTURE ### data.json
-{
-    "settings": {
-        "frequency": [
-            xx,
-            xxx
-        ],
-        "channel": <channel>
-    },
-    "users": {
-        "<user_id>": {
-            "<inventory_item>": x
-        },
-        .
-        .
-        .
-        
-    },
-    "quotes": [
-        {
-            "question": "<question>",
-            "answer": "<correct_answer>"
-        },
-        .
-        .
-        .
-        
-    ]
-}
-"""
+import asyncio
+
+import catalog
+import leaderboard
+import matcher
+import metrics
+import questions
+import sampler
+import storage
+
+
+# storage backend, "json", "lazy" or "sqlite". "lazy" is data.json with inventories read
+# on first use, for a fast start with many users. Existing data.json can be imported
+# to sqlite with python storage.py migrate
+STORAGE = "json"
+# seconds between checks for changes other processes made to a shared store
+SYNC_INTERVAL = 1.0
 
 
 class Database:
 
-    def __init__(self):
-        with open("data.json", "r") as f:
-            self.data = json.load(f)
-
-            # add categories if new data file
-            if 'settings' not in self.data:
-                self.data['settings'] = {}
-            if 'users' not in self.data:
-                self.data['users'] = {}
-            if 'quotes' not in self.data:
-                self.data['quotes'] = []
-            if 'whitelist' not in self.data:
-                self.data['whitelist'] = []
-
-    def save_data(self):
-        """Save data to file"""
-        with open("data.json", "w") as f:
-            json.dump(self.data, f, indent=4)
+    def __init__(self, backend=None):
+        self.storage = backend if backend is not None else storage.open_storage(STORAGE)
+        # image path <-> card id, inventories only hold the ids
+        self.cards = self.storage.cards
+        self.catalog = catalog.ImageCatalog()
+        self.sampler = sampler.RewardSampler(self.catalog)
+        self.pick_timer = metrics.registry.histogram("image_pick")
+        # {guild_id: {setting: value}}, read on every message so kept in memory
+        self.guild_settings = self.storage.get_setting('guilds', {})
+        # {guild_id: channel_id} of guilds that restrict the game to one channel
+        self.game_channels = {}
+        # {guild_id: typos} of guilds that set a tolerance, and the global fallback
+        self.tolerances = {}
+        self.default_tolerance = 0
+        self.index_guild_settings()
+        self.questions = questions.QuestionBank(self.storage.get_questions())
+        # (question, answer) -> AnswerMatcher, compiled once per question
+        self.matchers = {}
+        for question in self.questions:
+            self.get_matcher(question)
+        # userid -> counter bumped on every inventory change, for cached views
+        self.inventory_versions = {}
+        # item totals of every user, built on first use so startup doesn't read every inventory
+        self._leaderboard = None
+
+    def flush(self):
+        """Write all pending changes to disk now"""
+        self.storage.flush()
+
+    async def flush_loop(self):
+        await self.storage.flush_loop()
+
+    async def sync_loop(self, interval=SYNC_INTERVAL):
+        """Background task applying changes other processes make to a shared store"""
+        if not self.storage.shared:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Syncing with the store failed [{e}]")
+
+    def sync(self):
+        """Refresh everything cached in memory that another process changed in the store"""
+        changes = self.storage.poll_changes()
+        if changes is None:
+            return
+        sections, users = changes
+        if 'settings' in sections:
+            self.guild_settings = self.storage.get_setting('guilds', {})
+            self.index_guild_settings()
+        if 'questions' in sections:
+            self.questions = questions.QuestionBank(self.storage.get_questions())
+            for question in self.questions:
+                self.get_matcher(question)
+        for userid in users:
+            if self._leaderboard is not None:
+                self._leaderboard.set_total(userid, self.storage.get_inventory(userid).total())
+            self.bump_version(userid)
 
     def change_setting(self, setting, value):
         """Change a setting"""
-        self.data['settings'][setting] = value
-        self.save_data()
+        self.storage.set_setting(setting, value)
+        if setting == 'tolerance':
+            self.index_guild_settings()
 
     def add_question(self, question, answer):
-        entry = {"question": question,
-                 "answer": answer}
-        self.data['quotes'].append(entry)
-        self.save_data()
+        entry = self.storage.add_question(question, answer)
+        self.questions.add(entry)
+        self.get_matcher(entry)
+
+    def import_questions(self, pairs):
+        """Add every (question, answer) of an iterable with one save
+        :returns how many were added"""
+        entries = self.storage.add_questions(pairs)
+        for entry in entries:
+            self.questions.add(entry)
+            self.get_matcher(entry)
+        return len(entries)
 
     def remove_question(self, question):
-        for i in range(len(self.get_questions())):
-            if self.data['quotes'][i].get('question').lower() == question.lower():
-                del self.data['quotes'][i]
-                print("deleted", question)
-                self.save_data()
-                return True
+        # the bank finds the entry, storage only has to drop that exact one
+        found = self.questions.find(question)
+        if not found or not self.storage.remove_question(found[0]):
             return False
+        entry = self.questions.remove(question)
+        key = (entry.get('question'), entry.get('answer'))
+        if not any((other.get('answer') == key[1]) for other in self.questions.find(key[0])):
+            self.matchers.pop(key, None)
+        print("deleted", question)
+        return True
+
+    def get_matcher(self, question):
+        """Get the compiled answer matcher of a question"""
+        key = (question.get('question'), question.get('answer'))
+        compiled = self.matchers.get(key)
+        if compiled is None:
+            compiled = matcher.AnswerMatcher(question)
+            self.matchers[key] = compiled
+        return compiled
 
     def get_questions(self):
-        entries = self.data.get('quotes')
-        return entries
+        return list(self.questions)
 
-    def get_random_image(self):
-        directories = []
-        for f in os.listdir("img/"):
-            try:
-                int(f)
-                if os.listdir('img/' + f + '/'):
-                    directories.append(f)
-            except ValueError:
-                continue
+    def draw_question(self):
+        """:returns the next question to spawn, None if there are none"""
+        return self.questions.draw()
 
-        directory = random.choices(directories, [int(x) for x in directories])[0]
-        directory_items = os.listdir('img/' + directory + '/')
-        filename = random.choice(directory_items)
-        return f'img/{directory}/{filename}'
+    def get_random_image(self):
+        with metrics.Timer(self.pick_timer):
+            return self.sampler.draw()
 
     def get_setting(self, setting, default=None):
         """Get a setting"""
-        return self.data['settings'].get(setting, default)
+        return self.storage.get_setting(setting, default)
+
+    def get_guild_setting(self, guild_id, setting, default=None):
+        """Get a setting of one guild, falling back to the global setting"""
+        guild = self.guild_settings.get(str(guild_id))
+        if guild is not None and setting in guild:
+            return guild[setting]
+        return self.get_setting(setting, default)
+
+    def change_guild_setting(self, guild_id, setting, value):
+        """Change a setting of one guild"""
+        def change(guilds):
+            guilds.setdefault(str(guild_id), {})[setting] = value
+            return guilds
+
+        # read-modify-write in the store, another shard may have changed its own guilds meanwhile
+        self.guild_settings = self.storage.update_setting('guilds', change, {})
+        self.index_guild_settings()
+
+    def index_guild_settings(self):
+        self.game_channels = dict((int(guild_id), settings['channel'])
+                                  for guild_id, settings in self.guild_settings.items()
+                                  if settings.get('channel') is not None)
+        self.tolerances = dict((int(guild_id), settings['tolerance'])
+                               for guild_id, settings in self.guild_settings.items()
+                               if settings.get('tolerance') is not None)
+        self.default_tolerance = self.storage.get_setting('tolerance', 0)
+
+    def get_tolerance(self, guild_id):
+        """Typos allowed in answers in a guild, checked on every message so never hits the store"""
+        return self.tolerances.get(guild_id, self.default_tolerance)
+
+    def migrate_channel_setting(self, client):
+        """Move the global channel setting of single server setups to the server it belongs to"""
+        channel_id = self.get_setting('channel')
+        if channel_id is None:
+            return
+        channel = client.get_channel(channel_id)
+        if channel is not None and channel.guild.id not in self.game_channels:
+            self.change_guild_setting(channel.guild.id, 'channel', channel_id)
 
     def get_inventory(self, user):
-        if str(user.id) in self.data['users']:
-
-            # check if image exists on disk
-            inv = copy.copy(self.data['users'][str(user.id)])
-            for item in inv:
-                if not os.path.isfile(item):
-                    self.remove_inventory_item(user, item, delete_all=True)
-                    reference = check_reference(item)
-                    if reference is not None:
-                        self.add_inventory_item(user, reference, inv[item])
-
-            return self.data['users'][str(user.id)]
-        else:
-            return {}
+        """:returns Inventory of card ids, resolve them with self.cards.path"""
+        userid = str(user.id)
+        inventory = self.storage.get_inventory(userid)
+        if not inventory:
+            return inventory
+
+        # remap cards whose image is gone to where it moved, same as the reconcile job, or drop them, in one save
+        moves = {}
+        for card_id in inventory:
+            path = self.cards.path(card_id)
+            if not self.catalog.exists(path):
+                moved = self.catalog.relocate(path)
+                moves[card_id] = None if moved is None else self.cards.id(moved)
+        if moves:
+            self.move_items(userid, moves)
+            for card_id, moved in moves.items():
+                if moved is None:
+                    print(f"Removed missing [{self.cards.path(card_id)}] "
+                          f"from user [{user.name}#{user.discriminator}]")
+                else:
+                    print(f"Moved [{self.cards.path(card_id)}] to [{self.cards.path(moved)}] "
+                          f"for user [{user.name}#{user.discriminator}]")
+            inventory = self.storage.get_inventory(userid)
+
+        return inventory
+
+    def move_items_everywhere(self, moves, userids=None):
+        """Change or delete cards in every inventory at once
+        :param moves: {old_card_id: new_card_id or None to delete it}
+        :param userids: only change these users, by default everyone
+        :returns {userid: how many items were deleted} of every changed user"""
+        changed = self.storage.move_items_everywhere(moves, userids)
+        for userid, deleted in changed.items():
+            self.add_total(userid, -deleted)
+            self.bump_version(userid)
+        return changed
+
+    def move_items(self, userid, moves):
+        """move_items_everywhere for one user, the moved cards must be in their inventory
+        :returns how many items were deleted"""
+        deleted = self.storage.move_items(userid, moves)
+        self.add_total(userid, -deleted)
+        self.bump_version(userid)
+        return deleted
+
+    @property
+    def leaderboard(self):
+        """Leaderboard of item totals, changes made before it was built are already in the totals"""
+        if self._leaderboard is None:
+            board = leaderboard.Leaderboard()
+            for userid, total in self.storage.get_totals().items():
+                board.set_total(userid, total)
+            self._leaderboard = board
+        return self._leaderboard
+
+    def add_total(self, userid, amount):
+        if self._leaderboard is not None:
+            self._leaderboard.add(userid, amount)
+
+    def inventory_version(self, userid):
+        return self.inventory_versions.get(userid, 0)
+
+    def bump_version(self, userid):
+        self.inventory_versions[userid] = self.inventory_versions.get(userid, 0) + 1
 
     def add_inventory_item(self, user, item, amount=1):
-        """Add inventory item to given user"""
-
-        # create user entry if it doesn't exist
-        if str(user.id) not in self.data['users']:
-            self.data['users'][str(user.id)] = {}
-
-        # add [amount] to the quantity of item, or create it with value of [amount]
-        if item in self.data['users'][str(user.id)]:
-            self.data['users'][str(user.id)][item] += amount
-        else:
-            self.data['users'][str(user.id)][item] = amount
-
-        # save modified data to file
-        self.save_data()
+        """Add inventory item (an image path) to given user"""
+        self.storage.add_item(str(user.id), self.cards.id(item), amount)
+        self.add_total(str(user.id), amount)
+        self.bump_version(str(user.id))
         print(f"Added {amount} [{item}] to user [{user.name}#{user.discriminator}]")
 
     def remove_inventory_item(self, user, item, delete_all=False):
         """Remove inventory item from given user
         :returns False if removal failed, True on success"""
-
-        # if user doesn't exist, just return
-        if str(user.id) not in self.data['users']:
-            return False
-
-        # if item doesn't exist, just return
-        if item not in self.data['users'][str(user.id)]:
+        card_id = self.cards.get_id(item)
+        removed = 0 if card_id is None else self.storage.remove_item(str(user.id), card_id, delete_all)
+        if not removed:
             return False
 
-        if delete_all:
-            del self.data['users'][str(user.id)][item]
-        else:
-            # remove [amount] from item quantity
-            self.data['users'][str(user.id)][item] -= 1
+        self.add_total(str(user.id), -removed)
+        self.bump_version(str(user.id))
 
-            # if 0 or less, cleanup and delete entry
-            if self.data['users'][str(user.id)][item] <= 0:
-                del self.data['users'][str(user.id)][item]
-
-        # save modified data to file
-        self.save_data()
         print(f"Removed [{item}] from user [{user.name}#{user.discriminator}]")
         return True
 
     def get_whitelist(self, ctx):
-        whitelist = self.data.get('whitelist', [])
-        return [ctx.bot.appinfo.owner.id] + whitelist
+        return [ctx.bot.appinfo.owner.id] + self.storage.get_whitelist()
 
     def whitelist(self, userid):
-        self.data['whitelist'].append(int(userid))
-        self.save_data()
+        self.storage.add_whitelist(userid)
 
     def unwhitelist(self, userid):
-        self.data['whitelist'].remove(int(userid))
-        self.save_data()
+        self.storage.remove_whitelist(userid)
 
     def get_users(self):
-        return self.data['users']
-
-
-def check_reference(path_to_image):
-    reference_path = f"img/reference/{path_to_image.split('/')[-1]}"
-    if os.path.isfile(reference_path):
-        return reference_path
-    else:
-        reference_path = f"img/Reference/{path_to_image.split('/')[-1]}"
-        if os.path.isfile(reference_path):
-            return reference_path
-        else:
-            return None
-
-
+        return self.storage.get_users()
 
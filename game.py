@@ -3,10 +3,23 @@
 
 import discord
 from discord.ext import commands
+import io
 import random
+import threading
+import time
 import database
-import asyncio
-from operator import itemgetter
+import matcher
+import media
+import metrics
+import outbox
+import paginator
+import questions
+import reconcile
+import sampler
+import simulation
+import spawns
+import thumbnails
+import views
 
 database = database.Database()
 
@@ -15,44 +28,137 @@ class Game(commands.Cog):
 
     def __init__(self, client):
         self.client = client
-        self.counter = 0
-        self.threshold = random.randint(*database.get_setting("frequency", (10, 20)))
-        self.current_question = None
-        self.sending = False
+        self.answers = matcher.AnswerIndex()
+        self.spawns = spawns.SpawnStates(self.new_threshold,
+                                         on_evict=lambda state: self.answers.close(state.guild_id))
+        self.flusher = self.client.loop.create_task(database.flush_loop())
+        self.syncer = self.client.loop.create_task(database.sync_loop())
+        self.outbox = outbox.Outbox(client.loop)
+        self.menus = paginator.Paginator(client, self.outbox)
+        self.inventories = views.InventoryViews(database)
+        self.images = media.ImageCache(database.catalog)
+        self.media = media.MediaCache(database, self.outbox, self.images)
+        self.thumbnails = thumbnails.Thumbnails(database.catalog)
+        # every process of launcher.py shares thumbs/, only the one with shard 0 makes them
+        shard_ids = getattr(client, 'shard_ids', None)
+        self.thumbnailer = None
+        if shard_ids is None or 0 in shard_ids:
+            self.thumbnailer = self.client.loop.create_task(self.thumbnails.run())
+
+        self.message_timer = metrics.registry.histogram("on_message")
+        metrics.registry.gauge("active_guilds", lambda: len(self.spawns))
+        metrics.registry.gauge("menus", lambda: len(self.menus))
+        metrics.registry.gauge("send_queue_depth", self.outbox.depth)
+        metrics.registry.gauge("send_queue_channels", lambda: len(self.outbox.queues))
+        metrics.registry.gauge("cached_inventory_views", lambda: len(self.inventories.views))
+        metrics.registry.gauge("cached_media_urls", lambda: len(self.media.urls))
+        metrics.registry.gauge("image_cache_files", lambda: len(self.images))
+        metrics.registry.gauge("image_cache_bytes", lambda: self.images.size)
+        metrics.registry.gauge("image_cache_hits", lambda: self.images.hits)
+        metrics.registry.gauge("image_cache_misses", lambda: self.images.misses)
+        self.metrics_server = None
+        if metrics.PROMETHEUS_PORT is not None:
+            self.metrics_server = self.client.loop.create_task(metrics.serve(metrics.PROMETHEUS_PORT))
+
+        prefix = client.command_prefix
+        if isinstance(prefix, str):
+            self.prefixes = (prefix,)
+        elif isinstance(prefix, (list, tuple)):
+            self.prefixes = tuple(prefix)
+        else:
+            self.prefixes = ()
+
+    def cog_unload(self):
+        self.flusher.cancel()
+        self.syncer.cancel()
+        self.outbox.close()
+        if self.thumbnailer is not None:
+            self.thumbnailer.cancel()
+        self.thumbnails.close()
+        self.images.close()
+        if self.metrics_server is not None:
+            self.metrics_server.cancel()
+        self.client.loop.create_task(self.media.close())
+        database.flush()
+
+    async def cog_before_invoke(self, ctx):
+        ctx.started = time.perf_counter()
+
+    async def cog_after_invoke(self, ctx):
+        metrics.registry.observe("command", time.perf_counter() - ctx.started, ctx.command.qualified_name)
+
+    @staticmethod
+    def new_threshold(guild_id):
+        return random.randint(*database.get_guild_setting(guild_id, "frequency", (10, 20)))
+
+    @staticmethod
+    def spawn_channel(guild, default):
+        channel = guild.get_channel(database.get_guild_setting(guild.id, "channel", default.id))
+        return channel if channel is not None else default
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        database.migrate_channel_setting(self.client)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        await self.menus.dispatch(payload)
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        self.counter += 1
-        channel = message.guild.get_channel(database.get_setting("channel", message.channel.id))
-
-        # correct guess
-        if self.current_question is not None and message.channel.id == channel.id \
-                and message.content.strip().casefold() == self.current_question.get('answer').casefold():
-            self.current_question = None
-            response_image = database.get_random_image()
-            await channel.send(f"{message.author.mention} Correct Answer! You receive "
-                               f"**{response_image.split('/')[-1].partition('.')[0]}**",
-                               file=discord.File(response_image))
-            database.add_inventory_item(message.author, response_image)
+        # fast path, drop anything that can't take part in the game before any other work
+        if message.guild is None or message.author.bot:
+            return
+        game_channel = database.game_channels.get(message.guild.id)
+        if game_channel is not None and message.channel.id != game_channel:
+            return
+        if message.content.startswith(self.prefixes):
             return
 
-        if not self.sending and self.counter > self.threshold:
-            # spawn question
-            await self.spawn_question(channel)
+        started = time.perf_counter()
+        try:
+            channel = message.channel
+            guild_id = message.guild.id
+            state = self.spawns.get(guild_id)
+            state.counter += 1
+
+            # correct guess, only the first one claims the round
+            current_round = state.round
+            if state.current_question is not None and self.answers.match(
+                    guild_id, message.content, database.get_tolerance(guild_id)) \
+                    and state.claim(current_round):
+                self.answers.close(guild_id)
+                response_image = database.get_random_image()
+                database.add_inventory_item(message.author, response_image)
+                # a due check of the cached url can take up to media.VERIFY_TIMEOUT, don't hold up the handler
+                self.client.loop.create_task(self.media.send(
+                    channel, response_image, f"{message.author.mention} Correct Answer! You receive "
+                    f"**{response_image.split('/')[-1].partition('.')[0]}**", outbox.REWARD))
+                return
 
-    async def spawn_question(self, channel):
-        self.sending = True
-        self.current_question = random.choice(database.get_questions())
-        await channel.send(self.current_question.get('question'))
-        self.counter = 0
-        self.threshold = random.randint(*database.get_setting("frequency", (10, 20)))
-        self.sending = False
+            if state.take_spawn():
+                self.spawn_question(channel, state)
+        finally:
+            self.message_timer.observe(time.perf_counter() - started)
+
+    def spawn_question(self, channel, state):
+        question = database.draw_question()
+        if question is None:
+            return
+        state.open(question, self.new_threshold(channel.guild.id))
+        self.answers.open(channel.guild.id, database.get_matcher(question))
+        self.outbox.send(channel, question.get('question'), outbox.SPAWN)
 
     @commands.command()
     @commands.is_owner()
     async def status(self, ctx):
-        """See how close the next spawn is"""
-        await ctx.send(f"Counter: **{self.counter}**\nNext spawn at: **{self.threshold}**")
+        """See how close the next spawn is in this server"""
+        state = self.spawns.get(ctx.guild.id)
+        queue = self.outbox.stats()
+        await ctx.send(f"Counter: **{state.counter}**\nNext spawn at: **{state.threshold}**\n"
+                       f"Active servers: **{len(self.spawns)}**\n"
+                       f"Send queue: **{queue['depth']}** waiting, "
+                       f"**{queue['wait_p50'] * 1000:.0f}ms** p50 / **{queue['wait_p99'] * 1000:.0f}ms** p99 wait")
 
     @commands.command()
     @commands.is_owner()
@@ -75,16 +181,17 @@ class Game(commands.Cog):
         """Force question to spawn"""
         if ctx.author.id not in database.get_whitelist(ctx):
             return await ctx.send("Sorry, you are not authorized to use this command!")
-        channel = ctx.guild.get_channel(database.get_setting("channel", ctx.channel.id))
-        await self.spawn_question(channel)
+        channel = self.spawn_channel(ctx.guild, ctx.channel)
+        self.spawn_question(channel, self.spawns.get(ctx.guild.id))
 
     @commands.command()
     @commands.is_owner()
-    async def distribution(self, ctx, amount=100):
+    async def distribution(self, ctx, amount=100, seed: int = None):
         """Test the distribution of reward images"""
+        draws = sampler.RewardSampler(database.catalog, seed=seed).draw_many(int(amount))
         results = {}
-        for i in range(int(amount)):
-            result = '/'.join(database.get_random_image().split('/')[:-1]) + '/...'
+        for image in draws:
+            result = image.rpartition('/')[0] + '/...'
             if result in results:
                 results[result] += 1
             else:
@@ -96,6 +203,69 @@ class Game(commands.Cog):
 
         await ctx.send(text + "```")
 
+    @commands.command()
+    @commands.is_owner()
+    async def simulate(self, ctx, amount: int = 1000000, seed: int = None):
+        """Simulate the rarity of reward folders over many spawns"""
+        if amount < 1:
+            return await ctx.send("Amount must be at least 1")
+
+        tiers = list(database.catalog.tiers)
+        weights = list(database.catalog.weights)
+        if not tiers:
+            return await ctx.send("There are no reward folders to simulate")
+
+        # large runs take a while, keep them off the event loop
+        rows, chi_square, dof = await self.client.loop.run_in_executor(
+            None, simulation.simulate, tiers, weights, amount, seed)
+
+        text = f"simulated {amount} spawns...```\n{'folder':>10} {'count':>10} {'expected':>9} {'observed':>9}"
+        for tier, count, expected, observed in rows:
+            text += f"\n{database.catalog.root + '/' + tier:>10} {count:10d} {expected:8.3f}% {observed:8.3f}%"
+        text += f"\n\nchi-square = {chi_square:.3f} with {dof} degrees of freedom```"
+
+        await ctx.send(text)
+
+    @commands.command(name="metrics")
+    @commands.is_owner()
+    async def show_metrics(self, ctx):
+        """Show latency histograms, counters and queue sizes"""
+        text = metrics.registry.summary()
+        if len(text) > 1990:
+            text = text[:1990].rpartition("\n")[0]
+        await ctx.send(f"```{text}```")
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: float = 10.0):
+        """Sample what the bot is busy with for a number of seconds"""
+        seconds = min(max(seconds, 0.1), 60.0)
+        await ctx.send(f"Profiling for {seconds:g} seconds...")
+        result = await self.client.loop.run_in_executor(None, metrics.sample, threading.get_ident(), seconds)
+        text = metrics.profile_report(*result)
+        if len(text) > 1990:
+            text = text[:1990].rpartition("\n")[0]
+        await ctx.send(f"```{text}```")
+
+    @commands.command()
+    @commands.is_owner()
+    async def refresh(self, ctx):
+        """Rescan the image folders"""
+        # a large or network mounted tree can take a while, keep the scan off the event loop
+        await self.client.loop.run_in_executor(None, database.catalog.refresh)
+        await ctx.send(f"Found **{len(database.catalog)}** images in **{len(database.catalog.tiers)}** folders")
+
+    @commands.command()
+    @commands.is_owner()
+    async def reconcile(self, ctx, mode=None):
+        """Repair every inventory after images were moved or deleted. Use `dry` to only preview"""
+        # the folder scan runs in a thread, the users are repaired a chunk at a time
+        await self.client.loop.run_in_executor(None, database.catalog.refresh)
+        summary = await reconcile.reconcile_in_chunks(database, dry_run=mode == 'dry')
+        if len(summary) > 1900:
+            summary = summary[:1900] + "\n..."
+        await ctx.send(f"```\n{summary}```")
+
     @commands.command()
     @commands.is_owner()
     async def questions(self, ctx):
@@ -114,62 +284,26 @@ class Game(commands.Cog):
         if rows:
             pages.append("\n".join(rows))
 
-        content = discord.Embed(title="All questions and frequencies")
-        if not pages:
-            content.description = "No questions in database"
-        else:
-            content.description = pages[0]
-
-        if len(pages) > 1:
-            content.set_footer(text=f"page 1 of {len(pages)}")
-
-        my_msg = await ctx.send(embed=content)
-
-        if len(pages) > 1:
-
-            current_page = 0
-
-            def check(_reaction, _user):
-                return _reaction.message.id == my_msg.id and _reaction.emoji in ["⬅", "➡"] \
-                       and not _user == self.client.user
-
-            await my_msg.add_reaction("⬅")
-            await my_msg.add_reaction("➡")
-
-            while True:
-                try:
-                    reaction, user = await self.client.wait_for('reaction_add', timeout=3600.0, check=check)
-                except asyncio.TimeoutError:
-                    return
-                else:
-                    try:
-                        if reaction.emoji == "⬅" and current_page > 0:
-                            content.description = pages[current_page - 1]
-                            current_page -= 1
-                            await my_msg.remove_reaction("⬅", user)
-                        elif reaction.emoji == "➡":
-                            content.description = pages[current_page + 1]
-                            current_page += 1
-                            await my_msg.remove_reaction("➡", user)
-                        else:
-                            continue
-                        content.set_footer(text=f"page {current_page + 1} of {len(pages)}")
-                        await my_msg.edit(embed=content)
-                    except IndexError:
-                        continue
+        def render(page):
+            content = discord.Embed(title="All questions and frequencies")
+            content.description = pages[page] if pages else "No questions in database"
+            return content
+
+        await self.menus.send(ctx, paginator.Menu(render, len(pages)))
 
     @commands.command()
     @commands.is_owner()
     async def add(self, ctx, *, arguments):
         """Add a new question"""
-        try:
-            question, answer = arguments.split("|")
-        except ValueError:
+        question, _, answers = arguments.partition(matcher.ANSWER_SEPARATOR)
+        answers = matcher.split_answers(answers)
+        if not question.strip() or not answers:
             await ctx.send(f"`ERROR: Invalid format` Usage: "
-                           f"`{self.client.command_prefix}add <question> | <answer>`")
+                           f"`{self.client.command_prefix}add <question> | <answer> [| <other answer>...]`")
             return
 
-        database.add_question(question.strip(), answer.strip())
+        answer = f" {matcher.ANSWER_SEPARATOR} ".join(answers)
+        database.add_question(question.strip(), answer)
 
         await ctx.send(f"Added a new question: `{question}`\n"
                        f"With correct answer: `{answer}`\n")
@@ -180,6 +314,30 @@ class Game(commands.Cog):
         result = database.remove_question(question)
         await ctx.send("Removed the question" if result else "Could not find that question")
 
+    @commands.command(name="import")
+    @commands.is_owner()
+    async def import_questions(self, ctx):
+        """Add every question of an attached .jsonl or .csv file"""
+        if not ctx.message.attachments:
+            return await ctx.send("`ERROR: No file` Attach a .jsonl file of "
+                                  '{"question": ..., "answer": ...} lines or a .csv of question,answer rows')
+        attachment = ctx.message.attachments[0]
+        text = (await attachment.read()).decode("utf-8-sig", errors="replace")
+        added = database.import_questions(questions.read_questions(io.StringIO(text, newline=""),
+                                                                   questions.guess_format(attachment.filename)))
+        await ctx.send(f"Imported **{added}** questions, there are now **{len(database.questions)}**")
+
+    @commands.command()
+    @commands.is_owner()
+    async def export(self, ctx, fmt="jsonl"):
+        """Get every question as a .jsonl or .csv file"""
+        if fmt not in questions.FORMATS:
+            return await ctx.send(f"`ERROR: Invalid format` Use one of {', '.join(questions.FORMATS)}")
+        text = io.StringIO(newline="")
+        written = questions.write_questions(database.questions, text, fmt)
+        await ctx.send(f"Exported **{written}** questions",
+                       file=discord.File(io.BytesIO(text.getvalue().encode("utf-8")), filename=f"questions.{fmt}"))
+
     @commands.command()
     @commands.is_owner()
     async def setup(self, ctx, setting=None, value=None):
@@ -190,7 +348,7 @@ class Game(commands.Cog):
             except commands.errors.BadArgument as e:
                 return await ctx.send(str(e))
 
-            database.change_setting("channel", channel.id)
+            database.change_guild_setting(ctx.guild.id, "channel", channel.id)
             await ctx.send(f"New questions will now only be posted to {channel.mention}")
 
         elif setting == 'frequency':
@@ -203,156 +361,142 @@ class Game(commands.Cog):
                 await ctx.send("ERROR: Invalid format for frequency. `min-max`\nExample: `100-500`")
                 return
 
-            database.change_setting("frequency", (min_value, max_value))
+            database.change_guild_setting(ctx.guild.id, "frequency", (min_value, max_value))
             await ctx.send(f"New questions will now be posted every {min_value} to {max_value} messages.")
+
+        elif setting == 'tolerance':
+            try:
+                tolerance = int(value)
+            except (TypeError, ValueError):
+                return await ctx.send("ERROR: Tolerance must be a number of allowed typos.\nExample: `1`")
+
+            database.change_guild_setting(ctx.guild.id, "tolerance", max(tolerance, 0))
+            await ctx.send(f"Answers with up to {max(tolerance, 0)} typos will now be accepted.")
         else:
-            f = database.get_setting('frequency', (10, 20))
-            c = ctx.guild.get_channel(database.get_setting('channel'))
+            f = database.get_guild_setting(ctx.guild.id, 'frequency', (10, 20))
+            c = ctx.guild.get_channel(database.get_guild_setting(ctx.guild.id, 'channel'))
             m = f"**Current settings:**\n" \
                 f"Channel = {c.mention if c is not None else 'None'}\n" \
-                f"Frequency = every {f[0]} to {f[1]} messages"
+                f"Frequency = every {f[0]} to {f[1]} messages\n" \
+                f"Tolerance = {database.get_guild_setting(ctx.guild.id, 'tolerance', 0)} typos"
 
             await ctx.send(m)
 
     @commands.command()
     async def view(self, ctx, filename):
-        for item in database.get_inventory(ctx.author):
-            if '.'.join(item.split('/')[-1].split('.')[:-1]) == filename:
-                return await ctx.send(file=discord.File(item))
+        inventory = database.get_inventory(ctx.author)
+        for item in database.catalog.find(filename):
+            if self.owns(inventory, item):
+                return await self.media.send(ctx.channel, item, priority=outbox.REPLY)
+
+        suggestions = self.suggest(inventory, filename)
+        if suggestions:
+            return await ctx.send(f"No image named {filename} found in your inventory! Did you mean: "
+                                  + ", ".join(f"**{name}**" for name in suggestions))
         await ctx.send(f"No image named {filename} found in your inventory!")
 
+    @staticmethod
+    def owns(inventory, path):
+        card_id = database.cards.get_id(path)
+        return card_id is not None and card_id in inventory
+
+    @staticmethod
+    def suggest(inventory, name, limit=5):
+        """:returns names of owned cards sharing the longest possible prefix with [name]"""
+        for length in range(len(name), 0, -1):
+            found = []
+            for _, paths in database.catalog.search(name[:length]):
+                owned = [path for path in paths if Game.owns(inventory, path)]
+                if owned:
+                    found.append(views.card_name(owned[0]))
+                    if len(found) == limit:
+                        break
+            if found:
+                return found
+        return []
+
     @commands.command()
     async def inventory(self, ctx):
         """see your inventory"""
         per_page = 10
-        content = discord.Embed()
-        content.description = ""
-        rows = []
-        pages = []
-        total_qty = 0
-        for item, qty in database.get_inventory(ctx.author).items():
-            rows.append(f"{'.'.join(item.split('/')[-1].split('.')[:-1])} : **{qty}**")
-            total_qty += qty
+        order = None
+        view = self.inventories.get(ctx.author)
+
+        def render(page):
+            content = discord.Embed(title=f"{ctx.author.name}'s inventory - Total {view.total} items")
+            content.description = view.render(page, per_page, order) or "Your inventory is empty"
+            return content
+
+        def sort_by(key):
+            def button(menu):
+                nonlocal view, order
+                view = self.inventories.get(ctx.author)
+                order = key
+                menu.pages = view.page_count(per_page)
+                menu.page = 0
+            return button
+
+        buttons = {
+            "🔡": sort_by('name'),
+            "#⃣": sort_by('count'),
+        }
+        await self.menus.send(ctx, paginator.Menu(render, view.page_count(per_page), buttons))
 
-            if len(rows) == per_page:
-                pages.append("\n".join(rows))
-                rows = []
-
-        content.title = f"{ctx.author.name}'s inventory - Total {total_qty} items"
-
-        if rows:
-            pages.append("\n".join(rows))
-
-        if not pages:
-            content.description = "Your inventory is empty"
-        else:
-            content.description = pages[0]
-
-        if len(pages) > 1:
-            content.set_footer(text=f"page 1 of {len(pages)}")
-
-        my_msg = await ctx.send(embed=content)
-
-        current_page = 0
-
-        def check(_reaction, _user):
-            return _reaction.message.id == my_msg.id and not _user == self.client.user
-
-        if len(pages) > 1:
-            await my_msg.add_reaction("⬅")
-            await my_msg.add_reaction("➡")
-        await my_msg.add_reaction("🔡")
-        await my_msg.add_reaction("#⃣")
-
-        while True:
-            try:
-                reaction, user = await self.client.wait_for('reaction_add', timeout=3600.0, check=check)
-            except asyncio.TimeoutError:
-                return
-            else:
-                if len(pages) > 1:
-                    try:
-                        if reaction.emoji == "⬅":
-                            if current_page > 0:
-                                current_page -= 1
-                                content.description = pages[current_page]
-                                content.set_footer(text=f"page {current_page + 1} of {len(pages)}")
-
-                            await my_msg.edit(embed=content)
-                            await my_msg.remove_reaction("⬅", user)
-
-                        elif reaction.emoji == "➡":
-                            if current_page < len(pages) - 1:
-                                current_page += 1
-                                content.description = pages[current_page]
-                                content.set_footer(text=f"page {current_page + 1} of {len(pages)}")
-
-                            await my_msg.edit(embed=content)
-                            await my_msg.remove_reaction("➡", user)
-
-                    except IndexError:
-                        pass
-                if reaction.emoji == "🔡":
-                    pages = []
-                    rows = []
-                    inv = database.get_inventory(ctx.author)
-                    for item in sorted(inv.keys(), key=lambda x: '.'.join(x.split('/')[-1].split('.')[:-1]).lower()):
-                        rows.append(f"{'.'.join(item.split('/')[-1].split('.')[:-1])} : **{inv[item]}**")
-
-                        if len(rows) == per_page:
-                            pages.append("\n".join(rows))
-                            rows = []
-                    if rows:
-                        pages.append("\n".join(rows))
-
-                    content.description = pages[0]
-                    await my_msg.edit(embed=content)
-                    await my_msg.remove_reaction("🔡", user)
-                elif reaction.emoji == "#⃣":
-                    pages = []
-                    rows = []
-                    for item, qty in sorted(database.get_inventory(ctx.author).items(),
-                                            key=itemgetter(1), reverse=True):
-                        rows.append(f"{'.'.join(item.split('/')[-1].split('.')[:-1])} : **{qty}**")
-
-                        if len(rows) == per_page:
-                            pages.append("\n".join(rows))
-                            rows = []
-                    if rows:
-                        pages.append("\n".join(rows))
-
-                    content.description = pages[0]
-                    await my_msg.edit(embed=content)
-                    await my_msg.remove_reaction("#⃣", user)
-                else:
-                    continue
+    @commands.command()
+    async def collection(self, ctx):
+        """See your cards in one picture"""
+        if not self.thumbnails.available:
+            return await ctx.send("Collection pictures are not available, Pillow is not installed")
+
+        inventory = database.get_inventory(ctx.author)
+        if not inventory:
+            return await ctx.send("Your inventory is empty")
+        images = sorted((database.cards.path(card_id) for card_id in inventory), key=views.card_name)
+        async with ctx.typing():
+            data = await self.thumbnails.mosaic(str(ctx.author.id), database.inventory_version(str(ctx.author.id)),
+                                                images)
+        if data is None:
+            return await ctx.send("Thumbnails are still being made, try again in a moment")
+
+        extra = len(images) - thumbnails.MAX_TILES
+        await ctx.send(f"{ctx.author.name}'s collection" + (f" (and {extra} more)" if extra > 0 else ""),
+                       file=discord.File(io.BytesIO(data), filename="collection.jpg"))
+
+    def display_name(self, userid):
+        user = self.client.get_user(int(userid))
+        return user.name if user is not None else f"Unknown user {userid}"
 
     @commands.command()
-    async def leaderboard(self, ctx):
+    async def leaderboard(self, ctx, page=1):
         """Show the top collectors leaderboard"""
-        content = discord.Embed()
-        content.title = f"Top 5 collectors"
-        content.description = ''
-
-        usersdata = []
-        data = database.get_users()
-        for userid in data:
-
-            user = self.client.get_user(int(userid))
-
-            qty = 0
-            for item in data[userid]:
-                qty += data[userid][item]
-            usersdata.append((user, qty))
-
-        n = 0
-        for user, qty in sorted(usersdata, key=itemgetter(1), reverse=True):
-            if n == 5:
-                break
-            content.description += f"\n`{n + 1}.` **{user.name}** - **{qty}**"
-            n += 1
+        per_page = 10
+        board = database.leaderboard
+        pages = max(1, -(-len(board) // per_page))
+        page = min(max(page, 1), pages)
+
+        def render(page):
+            content = discord.Embed()
+            content.title = "Top collectors"
+            content.description = ''
+            for rank, userid, qty in board.page(page * per_page, per_page):
+                content.description += f"\n`{rank}.` **{self.display_name(userid)}** - **{qty}**"
+            if not content.description:
+                content.description = "Nobody has collected anything yet"
+            return content
+
+        await self.menus.send(ctx, paginator.Menu(render, pages, page=page - 1))
 
-        await ctx.send(embed=content)
+    @commands.command()
+    async def rank(self, ctx, _user=None):
+        """See your position on the leaderboard"""
+        user = ctx.author if _user is None else await commands.UserConverter().convert(ctx, _user)
+        result = database.leaderboard.rank(str(user.id))
+        if result is None:
+            return await ctx.send(f"**{user.name}** has not collected anything yet")
+
+        rank, qty = result
+        await ctx.send(f"**{user.name}** is rank **#{rank}** of **{len(database.leaderboard)}** "
+                       f"collectors with **{qty}** items")
 
 
 def setup(client):
@@ -0,0 +1,93 @@
+# Author : Joinemm
+# File   : launcher.py
+
+"""Run the bot as several processes, each one an AutoShardedBot with its own range
+of shards, all sharing one sqlite database. Changes one process makes to settings,
+questions, the whitelist or inventories reach the others within database.SYNC_INTERVAL.
+
+Writes run on each process's event loop and wait at most storage.BUSY_TIMEOUT (1 second)
+for another process holding the write lock, then fail with "database is locked".
+Most writes are a single row, the long ones are the reconcile command and storage.py migrate.
+
+    python storage.py migrate      # once, if you are coming from data.json
+    python launcher.py --shards 8 --processes 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+# seconds to wait before restarting a process that exited
+RESTART_DELAY = 5.0
+
+
+def shard_ranges(shard_count, processes):
+    """Split shard ids into [processes] contiguous ranges as evenly as possible"""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+def run_shards(shard_ids, shard_count):
+    """Entry point of one shard process"""
+    # every process writes to the same store, which only the sqlite backend allows
+    import database
+    database.STORAGE = "sqlite"
+
+    import main
+    main.run(shard_ids=shard_ids, shard_count=shard_count)
+
+
+def start(context, shard_ids, shard_count):
+    process = context.Process(target=run_shards, args=(shard_ids, shard_count),
+                              name=f"shards-{shard_ids[0]}-{shard_ids[-1]}")
+    process.start()
+    print(f"Started shards {shard_ids} as process {process.pid}")
+    return process
+
+
+def launch(shard_count, processes):
+    import storage
+
+    if not os.path.exists(storage.SQLITE_FILE):
+        print(f"{storage.SQLITE_FILE} not found. Run python storage.py migrate first to import {storage.DATA_FILE}")
+        return 1
+
+    # spawn, so no process inherits another's sqlite connection or event loop
+    context = multiprocessing.get_context("spawn")
+    ranges = shard_ranges(shard_count, processes)
+    running = dict((i, start(context, shard_ids, shard_count)) for i, shard_ids in enumerate(ranges))
+    try:
+        while True:
+            time.sleep(1.0)
+            for i, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                print(f"Shards {ranges[i]} exited with code {process.exitcode}, "
+                      f"restarting in {RESTART_DELAY:g} seconds")
+                time.sleep(RESTART_DELAY)
+                running[i] = start(context, ranges[i], shard_count)
+    except KeyboardInterrupt:
+        print("Stopping all shards")
+    finally:
+        for process in running.values():
+            process.terminate()
+        for process in running.values():
+            process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded processes")
+    parser.add_argument("--shards", type=int, required=True, help="total shard count")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    sys.exit(launch(args.shards, args.processes))
@@ -0,0 +1,101 @@
+# Author : Joinemm
+# File   : leaderboard.py
+
+import itertools
+
+
+class Leaderboard:
+    """Item totals of every user, kept ordered for rank queries.
+
+    Users are counted in a Fenwick tree indexed by their total, so updating a
+    total, looking up the rank of a user and finding where a page of the
+    leaderboard starts all cost O(log(highest total)). Users with equal totals
+    share a rank."""
+
+    def __init__(self, size=1024):
+        self.totals = {}
+        # total -> {userid: None}, users with that total in the order they reached it
+        self.groups = {}
+        self.size = size
+        self.tree = [0] * (size + 1)
+
+    def __len__(self):
+        return len(self.totals)
+
+    def _update(self, position, delta):
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    def _prefix(self, position):
+        """:returns number of users with a total of at most [position]"""
+        position = min(position, self.size)
+        count = 0
+        while position > 0:
+            count += self.tree[position]
+            position -= position & -position
+        return count
+
+    def _kth(self, k):
+        """:returns the total of the k-th (1 based) user in ascending order"""
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            following = position + step
+            if following <= self.size and self.tree[following] < k:
+                position = following
+                k -= self.tree[following]
+            step >>= 1
+        return position + 1
+
+    def _grow(self, total):
+        while self.size < total:
+            self.size *= 2
+        self.tree = [0] * (self.size + 1)
+        for group_total, group in self.groups.items():
+            self._update(group_total, len(group))
+
+    def set_total(self, userid, total):
+        old = self.totals.get(userid, 0)
+        if old == total:
+            return
+        if old > 0:
+            group = self.groups[old]
+            del group[userid]
+            if not group:
+                del self.groups[old]
+            self._update(old, -1)
+            del self.totals[userid]
+        if total > 0:
+            self.totals[userid] = total
+            self.groups.setdefault(total, {})[userid] = None
+            if total > self.size:
+                self._grow(total)
+            else:
+                self._update(total, 1)
+
+    def add(self, userid, amount):
+        self.set_total(userid, self.totals.get(userid, 0) + amount)
+
+    def rank(self, userid):
+        """:returns (rank, total) of a user or None if they have no items"""
+        total = self.totals.get(userid)
+        if total is None:
+            return None
+        return len(self.totals) - self._prefix(total) + 1, total
+
+    def page(self, start, count):
+        """:returns up to [count] (rank, userid, total) entries, skipping the first [start]"""
+        entries = []
+        users = len(self.totals)
+        position = start
+        while len(entries) < count and position < users:
+            total = self._kth(users - position)
+            above = users - self._prefix(total)
+            group = self.groups[total]
+            skip = position - above
+            # the best in a group is whoever got there first
+            members = list(itertools.islice(group, skip, skip + count - len(entries)))
+            entries.extend((above + 1, userid, total) for userid in members)
+            position += len(members)
+        return entries
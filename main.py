@@ -4,18 +4,28 @@
 from discord.ext import commands
 
 TOKEN = "XXX"  # your token here
+PREFIX = "q!"  # change prefix here
 extensions = ["game", "errors"]
 
-client = commands.Bot(command_prefix="q!")  # change prefix here
 
+def create_client(shard_ids=None, shard_count=None):
+    """A single bot, or one running the given shards when started by launcher.py"""
+    if shard_ids is None:
+        client = commands.Bot(command_prefix=PREFIX)
+    else:
+        client = commands.AutoShardedBot(command_prefix=PREFIX, shard_ids=shard_ids, shard_count=shard_count)
 
-@client.event
-async def on_ready():
-    if not hasattr(client, 'appinfo'):
-        client.appinfo = await client.application_info()
-    print("Bot is ready")
+    @client.event
+    async def on_ready():
+        if not hasattr(client, 'appinfo'):
+            client.appinfo = await client.application_info()
+        print("Bot is ready" if shard_ids is None else f"Shards {shard_ids} are ready")
 
-if __name__ == "__main__":
+    return client
+
+
+def run(shard_ids=None, shard_count=None):
+    client = create_client(shard_ids, shard_count)
     for extension in extensions:
         try:
             client.load_extension(extension)
@@ -24,3 +34,7 @@ if __name__ == "__main__":
             print(f"{extension} loading failed [{error}]")
 
     client.run(TOKEN)
+
+
+if __name__ == "__main__":
+    run()
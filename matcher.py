@@ -0,0 +1,118 @@
+# Author : Joinemm
+# File   : matcher.py
+
+import re
+import unicodedata
+
+
+# separates accepted answers in the answer of a question, e.g. "IU | Lee Ji-eun"
+ANSWER_SEPARATOR = "|"
+# at most this share of an answer's characters may be typos, whatever the tolerance
+TYPO_RATIO = 1 / 3
+
+_junk = re.compile(r"[\W_]+")
+
+
+def normalize(text):
+    """Canonical form answers are compared in: NFKC, casefolded,
+    punctuation removed and whitespace collapsed to single spaces.
+    Text that is nothing but punctuation or emoji keeps them, only casefolded"""
+    folded = unicodedata.normalize("NFKC", text).casefold()
+    return _junk.sub(" ", folded).strip() or " ".join(folded.split())
+
+
+def split_answers(answer):
+    return [a.strip() for a in answer.split(ANSWER_SEPARATOR) if a.strip()]
+
+
+def within_distance(a, b, limit):
+    """Check if the edit distance of a and b is at most [limit].
+    Only a band of width 2 * limit + 1 is computed, so this is O(len(a) * limit)."""
+    if abs(len(a) - len(b)) > limit:
+        return False
+    if len(a) < len(b):
+        a, b = b, a
+    big = limit + 1
+    previous = [j if j <= limit else big for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [big] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        lowest = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current[j] = value if value <= limit else big
+            if current[j] < lowest:
+                lowest = current[j]
+        if lowest > limit:
+            return False
+        previous = current
+    return previous[len(b)] <= limit
+
+
+class AnswerMatcher:
+    """A question compiled for fast answer checking"""
+
+    __slots__ = ('question', 'answers')
+
+    def __init__(self, question):
+        self.question = question
+        self.answers = frozenset(normalize(a) for a in split_answers(question.get('answer')))
+
+    def matches(self, normalized, tolerance=0):
+        """Check an already normalized guess against the accepted answers"""
+        if not normalized:
+            return False
+        if normalized in self.answers:
+            return True
+        for answer in self.answers:
+            limit = min(tolerance, int(len(answer) * TYPO_RATIO))
+            if limit > 0 and within_distance(normalized, answer, limit):
+                return True
+        return False
+
+
+class AnswerIndex:
+    """Open questions keyed by where they were asked (a guild or a channel).
+    A guess is normalized once and looked up for all open questions at the same time."""
+
+    def __init__(self):
+        self.open_questions = {}
+        # normalized answer -> keys of the open questions accepting it
+        self.answers = {}
+
+    def open(self, key, matcher):
+        self.close(key)
+        self.open_questions[key] = matcher
+        for answer in matcher.answers:
+            self.answers.setdefault(answer, set()).add(key)
+
+    def close(self, key):
+        """:returns the matcher that was open under [key] or None"""
+        matcher = self.open_questions.pop(key, None)
+        if matcher is not None:
+            for answer in matcher.answers:
+                keys = self.answers[answer]
+                keys.discard(key)
+                if not keys:
+                    del self.answers[answer]
+        return matcher
+
+    def match(self, key, guess, tolerance=0):
+        """:returns the matcher open under [key] if [guess] answers it, otherwise None"""
+        matcher = self.open_questions.get(key)
+        if matcher is None:
+            return None
+        normalized = normalize(guess)
+        if not normalized:
+            # image or sticker only messages
+            return None
+        if key in self.answers.get(normalized, ()):
+            return matcher
+        if tolerance > 0 and matcher.matches(normalized, tolerance):
+            return matcher
+        return None
+
+    def __len__(self):
+        return len(self.open_questions)
@@ -0,0 +1,195 @@
+# Author : Joinemm
+# File   : media.py
+
+import asyncio
+import collections
+import concurrent.futures
+import io
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+
+import aiohttp
+import discord
+
+import outbox
+
+
+# how long an uploaded image url is trusted when discord doesn't say when it expires, in seconds
+MEDIA_TTL = 12 * 3600.0
+# cached urls are checked to still exist at most this often, in seconds
+VERIFY_INTERVAL = 600.0
+# seconds to wait for that check before uploading the file again instead
+VERIFY_TIMEOUT = 2.0
+# card files kept in memory, by total size in bytes
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+# files bigger than this are always read from disk
+MAX_CACHED_FILE = 8 * 1024 * 1024
+IO_THREADS = 4
+
+
+def url_expiry(url, uploaded):
+    """Discord attachment urls carry their expiry as a hex timestamp in the ex parameter"""
+    try:
+        return float(int(parse_qs(urlparse(url).query)['ex'][0], 16))
+    except (KeyError, IndexError, ValueError):
+        return uploaded + MEDIA_TTL
+
+
+def read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class ImageCache:
+    """Card file bytes read in a thread pool instead of on the event loop, with the
+    most recently sent ones kept in an LRU bounded by their total size.
+    Everything is dropped when the catalog is rescanned, in case a file changed."""
+
+    def __init__(self, catalog, max_bytes=IMAGE_CACHE_BYTES, max_file=MAX_CACHED_FILE, threads=IO_THREADS):
+        self.catalog = catalog
+        self.max_bytes = max_bytes
+        self.max_file = max_file
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="image-io")
+        self.files = collections.OrderedDict()
+        self.size = 0
+        self.version = catalog.version
+        # path -> future of a read in progress, so concurrent misses read once
+        self.reading = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def clear(self):
+        self.files.clear()
+        self.size = 0
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+    async def read(self, path):
+        """:returns the bytes of a card file"""
+        if self.catalog.version != self.version:
+            self.version = self.catalog.version
+            self.clear()
+
+        data = self.files.get(path)
+        if data is not None:
+            self.files.move_to_end(path)
+            self.hits += 1
+            return data
+
+        self.misses += 1
+        future = self.reading.get(path)
+        if future is None:
+            future = asyncio.get_event_loop().run_in_executor(self.pool, read_file, path)
+            self.reading[path] = future
+            try:
+                data = await future
+            finally:
+                del self.reading[path]
+            self.store(path, data)
+            return data
+        return await asyncio.shield(future)
+
+    def store(self, path, data):
+        if len(data) > self.max_file or len(data) > self.max_bytes:
+            return
+        old = self.files.pop(path, None)
+        if old is not None:
+            self.size -= len(old)
+        self.files[path] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.files.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class MediaCache:
+    """Remembers the CDN url of every card image once it has been uploaded,
+    so later sends embed that url instead of uploading the file again.
+    The urls are kept in the store and survive restarts."""
+
+    def __init__(self, database, sender, images):
+        self.database = database
+        self.sender = sender
+        self.images = images
+        # card_id -> [url, expires, last verified]
+        self.urls = dict((card_id, [url, expires, 0.0])
+                         for card_id, (url, expires) in database.storage.get_media().items())
+        self.session = None
+        # card_id -> task checking its url
+        self.verifying = {}
+        self.uploads = 0
+        self.reuses = 0
+
+    async def close(self):
+        for task in self.verifying.values():
+            task.cancel()
+        if self.session is not None:
+            await self.session.close()
+
+    async def is_alive(self, card_id, entry):
+        """Whether a cached url can still be embedded, checked against the CDN now and then.
+        Concurrent sends of the same card share one check."""
+        now = time.time()
+        if now >= entry[1] - 60:
+            return False
+        if now - entry[2] < VERIFY_INTERVAL:
+            return True
+
+        task = self.verifying.get(card_id)
+        if task is None:
+            task = asyncio.get_event_loop().create_task(self.verify(card_id, entry))
+            self.verifying[card_id] = task
+        return await asyncio.shield(task)
+
+    async def verify(self, card_id, entry):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=VERIFY_TIMEOUT))
+        try:
+            async with self.session.head(entry[0]) as response:
+                alive = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            alive = False
+        finally:
+            del self.verifying[card_id]
+        if alive:
+            entry[2] = time.time()
+        return alive
+
+    def forget(self, card_id):
+        del self.urls[card_id]
+        self.database.storage.remove_media(card_id)
+
+    async def send(self, channel, path, content=None, priority=outbox.REWARD):
+        """Queue a card image to a channel, reusing an earlier upload when possible
+        :returns future of the sent message"""
+        card_id = self.database.cards.id(path)
+        entry = self.urls.get(card_id)
+        if entry is not None:
+            if await self.is_alive(card_id, entry):
+                self.reuses += 1
+                embed = discord.Embed()
+                embed.set_image(url=entry[0])
+                return self.sender.send(channel, content, priority, embed=embed)
+            if self.urls.get(card_id) is entry:
+                self.forget(card_id)
+
+        data = await self.images.read(path)
+        self.uploads += 1
+        future = self.sender.send(channel, content, priority,
+                                  file=discord.File(io.BytesIO(data), filename=os.path.basename(path)))
+        future.add_done_callback(lambda sent: self.uploaded(card_id, sent))
+        return future
+
+    def uploaded(self, card_id, sent):
+        if sent.cancelled() or sent.exception() is not None or not sent.result().attachments:
+            return
+        url = sent.result().attachments[0].url
+        now = time.time()
+        expires = url_expiry(url, now)
+        self.urls[card_id] = [url, expires, now]
+        self.database.storage.set_media(card_id, url, expires)
@@ -0,0 +1,198 @@
+# Author : Joinemm
+# File   : metrics.py
+
+import asyncio
+import bisect
+import collections
+import sys
+import time
+
+
+# latency bucket bounds in seconds, from 1 microsecond to 10 seconds
+BUCKETS = tuple(base * 10.0 ** exponent for exponent in range(-6, 1) for base in (1, 2.5, 5)) + (10.0,)
+PREFIX = "collector_"
+# serve prometheus text on this localhost port, None to disable
+PROMETHEUS_PORT = None
+# how often the profiler samples the loop thread, in seconds
+PROFILE_INTERVAL = 0.001
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum, like a prometheus histogram"""
+
+    __slots__ = ('counts', 'count', 'sum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """:returns upper bound of the bucket holding the [q] quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Timer:
+    """with registry.timer("name"): times the block into a histogram"""
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Registry:
+    """Histograms, counters and gauges of the running bot"""
+
+    def __init__(self):
+        # (name, label) -> Histogram
+        self.histograms = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        # name -> function returning the current value
+        self.gauges = collections.OrderedDict()
+
+    def histogram(self, name, label=None):
+        histogram = self.histograms.get((name, label))
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[(name, label)] = histogram
+        return histogram
+
+    def observe(self, name, seconds, label=None):
+        self.histogram(name, label).observe(seconds)
+
+    def timer(self, name, label=None):
+        return Timer(self.histogram(name, label))
+
+    def inc(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def summary(self):
+        """:returns plain text table of everything, for the metrics command"""
+        lines = [f"{'histogram':<28} {'count':>8} {'avg ms':>8} {'p50 ms':>8} {'p99 ms':>8}"]
+        for (name, label), histogram in self.histograms.items():
+            title = name if label is None else f"{name}[{label}]"
+            average = histogram.sum / histogram.count if histogram.count else 0.0
+            lines.append(f"{title[:28]:<28} {histogram.count:>8} {average * 1000:>8.3f} "
+                         f"{histogram.quantile(0.5) * 1000:>8.3f} {histogram.quantile(0.99) * 1000:>8.3f}")
+        lines.append("")
+        for name, value in self.counters.items():
+            lines.append(f"{name:<28} {value:>8}")
+        for name, function in self.gauges.items():
+            lines.append(f"{name:<28} {function():>8}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """:returns everything in the prometheus text exposition format"""
+        lines = []
+        described = set()
+        for (name, label), histogram in self.histograms.items():
+            metric = f"{PREFIX}{name}_seconds"
+            if metric not in described:
+                lines.append(f"# TYPE {metric} histogram")
+                described.add(metric)
+            labels = f'name="{label}",' if label is not None else ""
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{labels}le="{bound:g}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{labels}le="+Inf"}} {histogram.count}')
+            suffix = f"{{{labels[:-1]}}}" if labels else ""
+            lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+            lines.append(f"{metric}_count{suffix} {histogram.count}")
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE {PREFIX}{name}_total counter")
+            lines.append(f"{PREFIX}{name}_total {value}")
+        for name, function in self.gauges.items():
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            lines.append(f"{PREFIX}{name} {function()}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+async def serve(port=PROMETHEUS_PORT):
+    """Serve registry.prometheus() on http://127.0.0.1:[port]/metrics until cancelled"""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=registry.prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    print(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def sample(thread_id, seconds, interval=PROFILE_INTERVAL):
+    """Sample the stack of another thread for [seconds]. Run it off that thread.
+    :returns (samples, {(file, line, function): times on top of the stack},
+              {(file, line, function): times anywhere on the stack})"""
+    own = collections.Counter()
+    cumulative = collections.Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples += 1
+            code = frame.f_code
+            own[(code.co_filename, frame.f_lineno, code.co_name)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (code.co_filename, code.co_firstlineno, code.co_name)
+                if key not in seen:
+                    seen.add(key)
+                    cumulative[key] += 1
+                frame = frame.f_back
+        time.sleep(interval)
+    return samples, own, cumulative
+
+
+def profile_report(samples, own, cumulative, top=15):
+    """:returns plain text of the hottest functions of a sample() run"""
+    def where(key):
+        filename, line, function = key
+        return f"{function} ({filename.rsplit('/', 1)[-1]}:{line})"
+
+    if not samples:
+        return "No samples"
+    lines = [f"{samples} samples", "", "self %  where"]
+    for key, count in own.most_common(top):
+        lines.append(f"{count / samples * 100:6.1f}  {where(key)}")
+    lines += ["", "total %  function"]
+    for key, count in cumulative.most_common(top):
+        lines.append(f"{count / samples * 100:7.1f}  {where(key)}")
+    return "\n".join(lines)
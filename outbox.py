@@ -0,0 +1,142 @@
+# Author : Joinemm
+# File   : outbox.py
+
+import asyncio
+import collections
+import heapq
+import itertools
+import time
+
+
+# lower is sent first
+SPAWN = 0
+REWARD = 0
+REPLY = 1
+EDIT = 2
+
+# recent wait times kept for the percentiles in stats()
+WAIT_SAMPLES = 1000
+
+
+class ChannelQueue:
+
+    __slots__ = ('jobs', 'keyed', 'worker')
+
+    def __init__(self):
+        # heap of [priority, sequence, key, factory, futures, enqueued]
+        self.jobs = []
+        # coalescing key -> job still waiting in the heap
+        self.keyed = {}
+        self.worker = None
+
+
+class Outbox:
+    """Outgoing messages queued per channel and sent one at a time by a worker for
+    that channel, so a burst never makes handlers wait on discord's rate limits.
+
+    Spawns and rewards jump ahead of menu edits, and an edit still waiting in the
+    queue is replaced by a newer edit of the same message instead of queueing both."""
+
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.queues = {}
+        self.sequence = itertools.count()
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.waits = collections.deque(maxlen=WAIT_SAMPLES)
+        self.max_wait = 0.0
+
+    def depth(self):
+        """:returns number of messages waiting in every channel"""
+        return sum(len(queue.jobs) for queue in self.queues.values())
+
+    def submit(self, channel_id, factory, priority=REPLY, key=None):
+        """Queue a call to factory(), which returns the coroutine doing the request.
+        A job with the same key still in the queue takes the new factory instead.
+        :returns future of the request's result"""
+        future = self.loop.create_future()
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            queue = ChannelQueue()
+            self.queues[channel_id] = queue
+
+        job = queue.keyed.get(key) if key is not None else None
+        if job is not None:
+            job[3] = factory
+            job[4].append(future)
+            self.coalesced += 1
+            if priority < job[0]:
+                job[0] = priority
+                heapq.heapify(queue.jobs)
+        else:
+            job = [priority, next(self.sequence), key, factory, [future], time.perf_counter()]
+            heapq.heappush(queue.jobs, job)
+            if key is not None:
+                queue.keyed[key] = job
+
+        if queue.worker is None:
+            queue.worker = self.loop.create_task(self.work(channel_id, queue))
+        return future
+
+    def send(self, channel, content=None, priority=REPLY, **kwargs):
+        """Queue channel.send
+        :returns future of the sent message"""
+        return self.submit(channel.id, lambda: channel.send(content, **kwargs), priority)
+
+    def edit(self, message, priority=EDIT, **kwargs):
+        """Queue message.edit, replacing an edit of the same message that hasn't been sent yet"""
+        return self.submit(message.channel.id, lambda: message.edit(**kwargs), priority, key=('edit', message.id))
+
+    async def work(self, channel_id, queue):
+        try:
+            while queue.jobs:
+                _, _, key, factory, futures, enqueued = heapq.heappop(queue.jobs)
+                if key is not None:
+                    del queue.keyed[key]
+                wait = time.perf_counter() - enqueued
+                self.waits.append(wait)
+                self.max_wait = max(self.max_wait, wait)
+                try:
+                    result = await factory()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Sending to channel {channel_id} failed [{e}]")
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                            # nobody has to await it, don't warn about an unretrieved exception
+                            future.exception()
+                    continue
+                self.sent += 1
+                for future in futures:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            queue.worker = None
+            if not queue.jobs and self.queues.get(channel_id) is queue:
+                del self.queues[channel_id]
+
+    def stats(self):
+        """:returns dict of queue depth, throughput and wait times in seconds"""
+        waits = sorted(self.waits)
+        return {
+            'depth': self.depth(),
+            'channels': len(self.queues),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'failed': self.failed,
+            'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+            'wait_p99': waits[min(len(waits) - 1, len(waits) * 99 // 100)] if waits else 0.0,
+            'wait_max': self.max_wait,
+        }
+
+    def close(self):
+        for queue in self.queues.values():
+            if queue.worker is not None:
+                queue.worker.cancel()
+            for job in queue.jobs:
+                for future in job[4]:
+                    future.cancel()
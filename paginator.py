@@ -0,0 +1,123 @@
+# Author : Joinemm
+# File   : paginator.py
+
+import collections
+import time
+
+import discord
+
+import outbox
+
+
+# menus stop reacting this many seconds after their last use
+MENU_TTL = 3600.0
+# most menus kept alive at once, the least recently used are dropped first
+MAX_MENUS = 500
+
+PREVIOUS = "⬅"
+NEXT = "➡"
+
+
+class Menu:
+    """A message whose pages are flipped with reactions.
+
+    render  : function(page) returning the embed of that page
+    pages   : number of pages
+    buttons : extra {emoji: function(menu)}, called before the current page is rendered again"""
+
+    __slots__ = ('render', 'pages', 'buttons', 'page', 'message', 'expires')
+
+    def __init__(self, render, pages, buttons=None, page=0):
+        self.render = render
+        self.pages = pages
+        self.buttons = buttons or {}
+        self.page = min(max(page, 0), max(pages - 1, 0))
+        self.message = None
+        self.expires = 0.0
+
+    def embed(self):
+        content = self.render(self.page)
+        if self.pages > 1:
+            content.set_footer(text=f"page {self.page + 1} of {self.pages}")
+        return content
+
+
+class Paginator:
+    """Every live menu, driven by one raw reaction listener instead of a wait_for loop per menu"""
+
+    def __init__(self, client, sender, ttl=MENU_TTL, max_menus=MAX_MENUS):
+        self.client = client
+        self.sender = sender
+        self.ttl = ttl
+        self.max_menus = max_menus
+        # message id -> Menu, least recently used first
+        self.menus = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.menus)
+
+    async def send(self, ctx, menu):
+        """Send the first page of a menu and start listening to its reactions"""
+        menu.message = await ctx.send(embed=menu.embed())
+        if menu.pages > 1 or menu.buttons:
+            self.register(menu)
+            if menu.pages > 1:
+                await menu.message.add_reaction(PREVIOUS)
+                await menu.message.add_reaction(NEXT)
+            for emoji in menu.buttons:
+                await menu.message.add_reaction(emoji)
+        return menu.message
+
+    def register(self, menu):
+        now = time.monotonic()
+        menu.expires = now + self.ttl
+        self.menus[menu.message.id] = menu
+        self.menus.move_to_end(menu.message.id)
+        self.evict(now)
+
+    def evict(self, now=None):
+        """Drop expired menus, and the least recently used ones while over the limit"""
+        if now is None:
+            now = time.monotonic()
+        while self.menus:
+            oldest = next(iter(self.menus.values()))
+            if oldest.expires > now and len(self.menus) <= self.max_menus:
+                break
+            del self.menus[oldest.message.id]
+
+    async def dispatch(self, payload):
+        """Handle a raw reaction event, ignoring anything that isn't on a live menu"""
+        menu = self.menus.get(payload.message_id)
+        if menu is None or payload.user_id == self.client.user.id:
+            return
+
+        now = time.monotonic()
+        if menu.expires <= now:
+            self.evict(now)
+            return
+
+        emoji = str(payload.emoji)
+        if emoji == PREVIOUS and menu.pages > 1:
+            if menu.page > 0:
+                menu.page -= 1
+        elif emoji == NEXT and menu.pages > 1:
+            if menu.page < menu.pages - 1:
+                menu.page += 1
+        elif emoji in menu.buttons:
+            menu.buttons[emoji](menu)
+            menu.page = min(menu.page, max(menu.pages - 1, 0))
+        else:
+            return
+
+        self.register(menu)
+        # quick clicks only send the page the menu ended up on
+        self.sender.edit(menu.message, embed=menu.embed())
+        self.sender.submit(menu.message.channel.id, lambda: remove_reaction(menu.message, emoji, payload.user_id),
+                           outbox.EDIT)
+
+
+async def remove_reaction(message, emoji, user_id):
+    try:
+        await message.remove_reaction(emoji, discord.Object(id=user_id))
+    except discord.Forbidden:
+        pass
@@ -0,0 +1,155 @@
+# Author : Joinemm
+# File   : questions.py
+
+import argparse
+import csv
+import json
+import random
+import sys
+
+
+FORMATS = ("jsonl", "csv")
+
+
+class QuestionBank:
+    """Every question, indexed by casefolded question text, drawn from a shuffle bag
+    so all questions come up once before any of them repeats.
+
+    Removed questions are left in the bag and skipped when drawn, and added ones are
+    swapped into a random spot of it, so every operation is O(1)."""
+
+    def __init__(self, entries=(), rng=None):
+        self.rng = rng or random.Random()
+        self.next_id = 0
+        # question id -> {"question": ..., "answer": ...}, in insertion order
+        self.entries = {}
+        # casefolded question -> ids of the entries with that question
+        self.index = {}
+        self.bag = []
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def add(self, entry):
+        qid = self.next_id
+        self.next_id += 1
+        self.entries[qid] = entry
+        self.index.setdefault(entry.get('question').casefold(), []).append(qid)
+        # insert at a random position of the remaining bag
+        self.bag.append(qid)
+        i = self.rng.randrange(len(self.bag))
+        self.bag[i], self.bag[-1] = self.bag[-1], self.bag[i]
+
+    def find(self, question):
+        """:returns entries asking [question], ignoring case"""
+        return [self.entries[qid] for qid in self.index.get(question.casefold(), ())]
+
+    def remove(self, question):
+        """Remove the oldest entry asking [question], ignoring case
+        :returns the removed entry or None"""
+        key = question.casefold()
+        ids = self.index.get(key)
+        if not ids:
+            return None
+        qid = ids.pop(0)
+        if not ids:
+            del self.index[key]
+        return self.entries.pop(qid)
+
+    def draw(self):
+        """:returns the next question of the bag, refilling it once every question has been drawn"""
+        if not self.entries:
+            return None
+        while True:
+            if not self.bag:
+                self.bag = list(self.entries)
+                self.rng.shuffle(self.bag)
+            qid = self.bag.pop()
+            entry = self.entries.get(qid)
+            if entry is not None:
+                return entry
+
+
+def read_questions(lines, fmt):
+    """Parse questions one line at a time from jsonl, or csv of question,answer rows
+    with an optional header. Yields (question, answer) and skips lines without both."""
+    if fmt == "jsonl":
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict):
+                question, answer = entry.get('question'), entry.get('answer')
+                if isinstance(question, str) and isinstance(answer, str) and question.strip() and answer.strip():
+                    yield question.strip(), answer.strip()
+    elif fmt == "csv":
+        for row in csv.reader(lines):
+            if len(row) < 2 or not row[0].strip() or not row[1].strip():
+                continue
+            if row[0].strip().lower() == "question" and row[1].strip().lower() == "answer":
+                continue
+            yield row[0].strip(), row[1].strip()
+    else:
+        raise ValueError(f"Unknown question format {fmt}")
+
+
+def write_questions(entries, f, fmt):
+    """Write questions to a text file as jsonl or csv
+    :returns how many were written"""
+    written = 0
+    if fmt == "jsonl":
+        for entry in entries:
+            f.write(json.dumps({"question": entry.get('question'), "answer": entry.get('answer')},
+                               ensure_ascii=False) + "\n")
+            written += 1
+    elif fmt == "csv":
+        writer = csv.writer(f)
+        writer.writerow(("question", "answer"))
+        for entry in entries:
+            writer.writerow((entry.get('question'), entry.get('answer')))
+            written += 1
+    else:
+        raise ValueError(f"Unknown question format {fmt}")
+    return written
+
+
+def guess_format(filename):
+    return "csv" if filename.lower().endswith(".csv") else "jsonl"
+
+
+if __name__ == "__main__":
+    import storage
+    from database import STORAGE
+
+    parser = argparse.ArgumentParser(description="Bulk import and export of questions")
+    parser.add_argument("command", choices=("import", "export"))
+    parser.add_argument("filename")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="default from the file extension")
+    parser.add_argument("--stopped", action="store_true", help="confirm the bot is not running")
+    args = parser.parse_args()
+    fmt = args.format or guess_format(args.filename)
+
+    store = storage.open_storage(STORAGE)
+    if args.command == "import" and not (store.shared or args.stopped):
+        # the bot saves the whole json file and would drop questions added behind its back
+        print(f"The bot saves the whole {STORAGE} store and would overwrite this import. "
+              f"Stop it and rerun with --stopped, or use the import command while it runs.")
+        sys.exit(1)
+    if args.command == "import":
+        with open(args.filename, newline="", encoding="utf-8") as f:
+            added = len(store.add_questions(read_questions(f, fmt)))
+        print(f"Imported {added} questions from {args.filename}")
+    else:
+        with open(args.filename, "w", newline="", encoding="utf-8") as f:
+            written = write_questions(store.get_questions(), f, fmt)
+        print(f"Exported {written} questions to {args.filename}")
+    store.close()
@@ -0,0 +1,102 @@
+# Author : Joinemm
+# File   : reconcile.py
+
+"""Repair inventories after images in img/ were renamed, moved or deleted.
+
+Every owned card whose image no longer exists is moved to the image with the same
+filename, looking in the weight folders first and the reference folders second.
+Cards with no match are deleted. All users are rewritten in one pass and one save.
+
+    python reconcile.py [--dry-run] [--stopped]
+
+The json and lazy backends are saved by the bot as a whole, so the bot must be stopped
+while this runs or it will overwrite the repair. Pass --stopped to confirm it is.
+A running bot can use the reconcile command instead.
+"""
+
+import argparse
+import asyncio
+import sys
+
+import database
+
+# users the reconcile command repairs before it lets the event loop run again
+CHUNK_USERS = 500
+
+
+def plan(db, card_ids=None):
+    """:returns {stale_card_id: new_path or None} for every card of [card_ids] whose image is gone,
+    by default of every owned card"""
+    catalog = db.catalog
+    moves = {}
+    for card_id in db.storage.get_items() if card_ids is None else card_ids:
+        path = db.cards.path(card_id)
+        if path not in catalog.paths:
+            moves[card_id] = catalog.relocate(path)
+    return moves
+
+
+def reconcile(db, dry_run=False):
+    """Plan and apply the repair
+    :returns summary text"""
+    moves = plan(db)
+    if dry_run:
+        return describe(db, moves)
+
+    changed = db.move_items_everywhere(card_moves(db, moves)) if moves else {}
+    db.flush()
+    return describe(db, moves, changed)
+
+
+async def reconcile_in_chunks(db, dry_run=False, chunk=CHUNK_USERS):
+    """reconcile for the running bot. Candidates come from the card registry instead of every
+    inventory, and users are repaired [chunk] at a time, each chunk with one save,
+    with the event loop running in between
+    :returns summary text"""
+    candidates = plan(db, list(db.cards.paths))
+    moves = card_moves(db, candidates)
+    owned = set()
+    changed = {}
+    userids = list(db.storage.get_totals())
+    for start in range(0, len(userids), chunk):
+        stale_users = []
+        for userid in userids[start:start + chunk]:
+            stale = [card_id for card_id in db.storage.get_inventory(userid) if card_id in moves]
+            if stale:
+                owned.update(stale)
+                stale_users.append(userid)
+        # one storage call and one save per chunk
+        if stale_users and not dry_run:
+            changed.update(db.move_items_everywhere(moves, stale_users))
+        await asyncio.sleep(0)
+
+    candidates = dict((card_id, new) for card_id, new in candidates.items() if card_id in owned)
+    return describe(db, candidates) if dry_run else describe(db, candidates, changed)
+
+
+def card_moves(db, moves):
+    """:returns {stale_card_id: new_card_id or None} of a plan"""
+    return dict((old, None if new is None else db.cards.id(new)) for old, new in moves.items())
+
+
+def describe(db, moves, changed=None):
+    """:returns summary text of a plan, listing every move if it was not applied"""
+    remapped = sum(1 for new in moves.values() if new is not None)
+    summary = f"{len(moves)} stale cards: {remapped} remapped, {len(moves) - remapped} deleted"
+    if changed is None:
+        lines = sorted(f"{db.cards.path(old)} -> {new}" for old, new in moves.items())
+        return "\n".join([summary + " (dry run)"] + lines)
+    return f"{summary}\n{len(changed)} users changed, {sum(changed.values())} items deleted"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Repair inventories after images were moved or deleted")
+    parser.add_argument("--dry-run", action="store_true", help="only list what would change")
+    parser.add_argument("--stopped", action="store_true", help="confirm the bot is not running")
+    args = parser.parse_args()
+    db = database.Database()
+    if not (db.storage.shared or args.dry_run or args.stopped):
+        print(f"The bot saves the whole {database.STORAGE} store and would overwrite this repair. "
+              f"Stop it and rerun with --stopped, or use the reconcile command while it runs.")
+        sys.exit(1)
+    print(reconcile(db, dry_run=args.dry_run))
@@ -0,0 +1,85 @@
+# Author : Joinemm
+# File   : sampler.py
+
+import random
+
+
+class RewardSampler:
+    """Draws reward images from an ImageCatalog in constant time.
+
+    The rarity tier is picked from an alias table (Vose's method) and the file
+    uniformly within the tier, so a draw costs two random numbers no matter how many
+    tiers or files there are. Pass a seed to make the sequence of draws reproducible."""
+
+    def __init__(self, catalog, seed=None):
+        self.catalog = catalog
+        self.random = random.Random(seed)
+        self.version = None
+        self.tiers = []
+        self.probability = []
+        self.alias = []
+        self.rebuild()
+
+    def rebuild(self):
+        """Build the alias table from the current catalog weights"""
+        weights = self.catalog.weights
+        n = len(weights)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights] if total else []
+        probability = [1.0] * n
+        alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            probability[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # anything left is 1 up to float rounding
+
+        self.tiers = [self.catalog.folders[tier] for tier in self.catalog.tiers]
+        self.probability = probability
+        self.alias = alias
+        self.version = self.catalog.version
+
+    def draw_tier(self):
+        """:returns index of a randomly drawn tier in catalog.tiers"""
+        i = int(self.random.random() * len(self.probability))
+        if self.random.random() < self.probability[i]:
+            return i
+        return self.alias[i]
+
+    def check(self):
+        """Rebuild the alias table if the catalog was rescanned"""
+        self.catalog.check()
+        if self.version != self.catalog.version:
+            self.rebuild()
+
+    def draw(self):
+        """:returns path of one randomly drawn reward image"""
+        self.check()
+        files = self.tiers[self.draw_tier()]
+        return files[int(self.random.random() * len(files))]
+
+    def draw_many(self, k):
+        """:returns list of k randomly drawn reward images"""
+        self.check()
+        rand = self.random.random
+        n = len(self.probability)
+        probability = self.probability
+        alias = self.alias
+        tiers = self.tiers
+        results = []
+        for _ in range(k):
+            i = int(rand() * n)
+            if rand() >= probability[i]:
+                i = alias[i]
+            files = tiers[i]
+            results.append(files[int(rand() * len(files))])
+        return results
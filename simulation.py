@@ -0,0 +1,59 @@
+# Author : Joinemm
+# File   : simulation.py
+
+import collections
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# samples drawn per batch by the pure python fallback, bounds its memory use
+CHUNK_SIZE = 1_000_000
+
+
+def draw_counts(weights, amount, seed=None):
+    """Draw [amount] tiers in one batch
+    :returns list of how many times each tier was drawn"""
+    total = sum(weights)
+    if numpy is not None:
+        # the per-tier counts of n independent draws are exactly multinomial
+        rng = numpy.random.default_rng(seed)
+        return rng.multinomial(amount, numpy.array(weights, dtype=float) / total).tolist()
+
+    rng = random.Random(seed)
+    indices = range(len(weights))
+    counter = collections.Counter()
+    remaining = amount
+    while remaining > 0:
+        k = min(remaining, CHUNK_SIZE)
+        counter.update(rng.choices(indices, weights, k=k))
+        remaining -= k
+    return [counter[i] for i in indices]
+
+
+def simulate(tiers, weights, amount, seed=None):
+    """Monte Carlo check of a rarity table.
+    :returns (rows, chi_square, degrees_of_freedom) where rows are
+             (tier, observed count, expected percent, observed percent)"""
+    total = sum(weights)
+    if total <= 0:
+        # nothing can be drawn, every tier stays empty
+        return [(tier, 0, 0.0, 0.0) for tier in tiers], 0.0, 0
+
+    counts = draw_counts(weights, amount, seed)
+
+    rows = []
+    chi_square = 0.0
+    drawable = 0
+    for tier, weight, observed in zip(tiers, weights, counts):
+        # a zero weight tier can never be drawn, it is listed but not tested
+        if weight > 0:
+            expected = amount * weight / total
+            chi_square += (observed - expected) ** 2 / expected
+            drawable += 1
+        rows.append((tier, observed, 100 * weight / total, 100 * observed / amount))
+
+    return rows, chi_square, max(drawable - 1, 0)
@@ -0,0 +1,89 @@
+# Author : Joinemm
+# File   : spawns.py
+
+import collections
+import time
+
+
+# guilds without messages for this many seconds have their spawn state dropped
+IDLE_TIMEOUT = 3600.0
+
+
+class GuildState:
+    """Spawn progress of one guild.
+
+    Every question put up starts a new round. Each transition checks and changes
+    the state without awaiting in between, so concurrent handlers on the event loop
+    can't both take the same spawn or both claim the same round, and no lock is needed."""
+
+    __slots__ = ('guild_id', 'counter', 'threshold', 'current_question', 'round', 'last_active')
+
+    def __init__(self, guild_id, threshold):
+        self.guild_id = guild_id
+        self.counter = 0
+        self.threshold = threshold
+        self.current_question = None
+        self.round = 0
+        self.last_active = time.monotonic()
+
+    def take_spawn(self):
+        """:returns True for the one message that pushes the counter past the threshold"""
+        if self.counter <= self.threshold:
+            return False
+        self.counter = 0
+        return True
+
+    def open(self, question, threshold):
+        """Put up a question, replacing any unanswered one
+        :returns the new round"""
+        self.round += 1
+        self.current_question = question
+        self.counter = 0
+        self.threshold = threshold
+        return self.round
+
+    def claim(self, round):
+        """:returns True for the first caller claiming an open round, False for everyone after"""
+        if self.current_question is None or self.round != round:
+            return False
+        self.current_question = None
+        return True
+
+
+class SpawnStates:
+    """Spawn state of every active guild, kept in least recently active order
+    so idle guilds can be evicted from the front in O(1) per guild."""
+
+    def __init__(self, new_threshold, on_evict=None, idle_timeout=IDLE_TIMEOUT):
+        self.new_threshold = new_threshold
+        self.on_evict = on_evict
+        self.idle_timeout = idle_timeout
+        self.states = collections.OrderedDict()
+
+    def get(self, guild_id):
+        """Get the state of a guild, creating it if needed"""
+        now = time.monotonic()
+        state = self.states.get(guild_id)
+        if state is None:
+            state = GuildState(guild_id, self.new_threshold(guild_id))
+            self.states[guild_id] = state
+        else:
+            self.states.move_to_end(guild_id)
+        state.last_active = now
+        self.evict(now)
+        return state
+
+    def evict(self, now=None):
+        """Drop the state of guilds that have been idle longer than the timeout"""
+        if now is None:
+            now = time.monotonic()
+        while self.states:
+            oldest = next(iter(self.states.values()))
+            if now - oldest.last_active < self.idle_timeout:
+                break
+            del self.states[oldest.guild_id]
+            if self.on_evict is not None:
+                self.on_evict(oldest)
+
+    def __len__(self):
+        return len(self.states)
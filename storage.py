@@ -0,0 +1,1142 @@
+# Author : Joinemm
+# File   : storage.py
+
+import argparse
+import asyncio
+import atexit
+import contextlib
+import json
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+from array import array
+from bisect import bisect_left
+import collections
+
+from cards import CardRegistry, Inventory
+import metrics
+
+
+""" DATABASE STRUCTURE ### data.json
+{
+    "settings": {
+        "frequency": [
+            xx,
+            xxx
+        ],
+        "channel": <channel>
+    },
+    "cards": [
+        "<image_path of card 0>",
+        "<image_path of card 1>",
+        .
+        .
+        .
+
+    ],
+    "users": {
+        "<user_id>": [<card_id>, <card_id>, ..., <amount>, <amount>, ...],
+        .
+        .
+        .
+
+    },
+    "quotes": [
+        {
+            "question": "<question>",
+            "answer": "<correct_answer>"
+        },
+        .
+        .
+        .
+
+    ]
+}
+Files from before card ids, with "users": {"<user_id>": {"<image_path>": x}}, are converted on load.
+The lazy backend moves "users" into users.dat and users.idx, and data.json gets "users_file": "users.dat" instead.
+"""
+
+DATA_FILE = "data.json"
+SQLITE_FILE = "data.db"
+
+# write-behind persistence for the json backend
+# "sync"     : write the file on every change (safest, slowest)
+# "interval" : coalesce changes and write at most every FLUSH_INTERVAL seconds,
+#              or sooner once FLUSH_AFTER changes are pending.
+#              At most FLUSH_INTERVAL seconds of changes are lost on a crash.
+DURABILITY = "interval"
+FLUSH_INTERVAL = 5.0
+FLUSH_AFTER = 100
+
+# lazy backend: inventories go to these files next to the data file, and are read on first use
+USERS_FILE = "users.dat"
+# lazy backend: most unchanged inventories kept in memory after being read
+LAZY_CACHE_USERS = 100000
+# lazy backend: rewrite the users files once their journal holds this share of the users,
+# and at least COMPACT_MIN_RECORDS records
+COMPACT_RATIO = 0.5
+COMPACT_MIN_RECORDS = 1000
+
+# sqlite: seconds to wait for another process holding the write lock. Storage calls run on
+# the event loop, so this is also the longest a shard can stall on a contended write
+BUSY_TIMEOUT = 1.0
+# sqlite: seconds inventory changes are kept for other processes to pick up
+CHANGE_RETENTION = 3600.0
+
+
+class Storage:
+    """Interface of a storage backend. User ids are always passed as strings,
+    cards as ids from the backend's CardRegistry in self.cards."""
+
+    cards = None
+    # True if several processes can use the same store at once
+    shared = False
+
+    def get_setting(self, setting, default=None):
+        raise NotImplementedError
+
+    def set_setting(self, setting, value):
+        raise NotImplementedError
+
+    def update_setting(self, setting, function, default=None):
+        """Replace a setting with function(current value) without losing
+        concurrent changes made by other processes
+        :returns the new value"""
+        value = function(self.get_setting(setting, default))
+        self.set_setting(setting, value)
+        return value
+
+    def get_questions(self):
+        """:returns list of {"question": ..., "answer": ...}"""
+        raise NotImplementedError
+
+    def add_question(self, question, answer):
+        """:returns the new question entry"""
+        raise NotImplementedError
+
+    def add_questions(self, pairs):
+        """Add many questions with a single write
+        :param pairs: iterable of (question, answer), consumed once
+        :returns list of the new question entries"""
+        raise NotImplementedError
+
+    def remove_question(self, entry):
+        """Remove one question
+        :param entry: the entry as returned by get_questions or add_question
+        :returns False if it was already gone, True on success"""
+        raise NotImplementedError
+
+    def get_whitelist(self):
+        raise NotImplementedError
+
+    def add_whitelist(self, userid):
+        raise NotImplementedError
+
+    def remove_whitelist(self, userid):
+        raise NotImplementedError
+
+    def get_inventory(self, userid):
+        """:returns Inventory of the user, empty if the user has nothing"""
+        raise NotImplementedError
+
+    def add_item(self, userid, card_id, amount=1):
+        raise NotImplementedError
+
+    def remove_item(self, userid, card_id, delete_all=False):
+        """:returns how many were removed, 0 if the user does not own the card"""
+        raise NotImplementedError
+
+    def move_items(self, userid, moves):
+        """Change cards in one go, merging amounts into the new card.
+        :param moves: {old_card_id: new_card_id or None to delete it}
+        :returns how many items were deleted"""
+        raise NotImplementedError
+
+    def move_items_everywhere(self, moves, userids=None):
+        """Apply move_items to every user in one pass and one write
+        :param userids: only change these users, by default everyone
+        :returns {userid: how many items were deleted} of every changed user"""
+        raise NotImplementedError
+
+    def get_items(self):
+        """:returns set of every card id owned by anyone"""
+        raise NotImplementedError
+
+    def get_users(self):
+        """:returns {userid: Inventory} for every user"""
+        raise NotImplementedError
+
+    def get_totals(self):
+        """:returns {userid: number of items} for every user"""
+        return dict((userid, inventory.total()) for userid, inventory in self.get_users().items())
+
+    def get_media(self):
+        """:returns {card_id: (url, expires)} of every card image uploaded before"""
+        raise NotImplementedError
+
+    def set_media(self, card_id, url, expires):
+        raise NotImplementedError
+
+    def remove_media(self, card_id):
+        raise NotImplementedError
+
+    def poll_changes(self):
+        """Check for changes committed by other processes since the last poll
+        :returns (set of changed sections: "settings", "questions", "cards",
+                  set of userids whose inventory changed), or None if nothing changed"""
+        return None
+
+    def flush(self):
+        """Make all changes durable"""
+        pass
+
+    async def flush_loop(self):
+        """Background task for backends that defer their writes"""
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JSONStorage(Storage):
+    """Whole database kept in memory and written to one json file"""
+
+    def __init__(self, filename=DATA_FILE, durability=DURABILITY,
+                 flush_interval=FLUSH_INTERVAL, flush_after=FLUSH_AFTER):
+        self.filename = filename
+        self.durability = durability
+        self.flush_interval = flush_interval
+        self.flush_after = flush_after
+
+        self.pending = 0
+        self.generation = 0
+        self.written_generation = 0
+        # how many times the file was written
+        self.writes = 0
+        self.write_lock = threading.Lock()
+        self.wakeup = None
+
+        with open(self.filename, "r") as f:
+            self.data = json.load(f)
+
+        # add categories if new data file
+        if 'settings' not in self.data:
+            self.data['settings'] = {}
+        if 'whitelist' not in self.data:
+            self.data['whitelist'] = []
+        if 'media' not in self.data:
+            self.data['media'] = {}
+
+        # id of the entry -> entry, in insertion order, so a question is removed without a scan
+        self.quotes = dict((id(entry), entry) for entry in self.data.pop('quotes', []))
+        self.cards = CardRegistry(dict(enumerate(self.data.pop('cards', []))))
+        users = {}
+        for userid, inventory in self.data.pop('users', {}).items():
+            if isinstance(inventory, dict):
+                # file from before card ids
+                inventory = Inventory((self.cards.id(path), amount) for path, amount in inventory.items())
+            else:
+                inventory = Inventory.from_list(inventory)
+            if inventory:
+                users[userid] = inventory
+        users_file = self.data.pop('users_file', None)
+        self.load_users(users, users_file)
+
+        # never lose coalesced changes on a clean exit
+        atexit.register(self.flush)
+
+    def load_users(self, users, users_file):
+        """Take the inventories, from the file itself and from the users files
+        the lazy backend splits them into"""
+        self.users = users
+        if users_file is not None:
+            index = UserIndex(self.path(users_file))
+            for userid in index:
+                self.users[userid] = index.read(userid)
+            index.close()
+
+    def path(self, filename):
+        """Path of a file next to the data file"""
+        return os.path.join(os.path.dirname(os.path.abspath(self.filename)), filename)
+
+    def save_data(self):
+        """Mark data as changed. Written immediately in sync mode, otherwise by the flusher"""
+        self.pending += 1
+        self.generation += 1
+        metrics.registry.inc("saves")
+        if self.durability == "sync" or self.wakeup is None:
+            self.flush()
+        elif self.pending >= self.flush_after:
+            self.wakeup.set()
+
+    def flush(self):
+        """Write all pending changes to disk now"""
+        if self.pending == 0:
+            return
+        self._write(self._serialize(), self.generation)
+
+    async def flush_loop(self):
+        """Background task coalescing pending changes into one write per interval"""
+        self.wakeup = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+                if self.pending == 0:
+                    continue
+                # serialize on the loop so the snapshot is consistent, write in a thread
+                payload = self._serialize()
+                try:
+                    await loop.run_in_executor(None, self._write, payload, self.generation)
+                except OSError as e:
+                    print(f"Saving data failed, retrying next interval [{e}]")
+                    self.pending += 1
+        finally:
+            self.wakeup = None
+
+    def _serialize(self):
+        with metrics.registry.timer("storage_serialize"):
+            self.pending = 0
+            data = dict(self.data)
+            data['cards'] = [self.cards.paths.get(card_id) for card_id in range(self.cards.next_id)]
+            data['quotes'] = list(self.quotes.values())
+            data['users'] = dict((userid, inventory.to_list()) for userid, inventory in self.users.items())
+            return json.dumps(data, separators=(',', ':'))
+
+    def _write(self, payload, generation):
+        """Atomically replace the data file, ignoring snapshots older than what is on disk"""
+        with self.write_lock, metrics.registry.timer("storage_write"):
+            if generation < self.written_generation:
+                return
+            self._replace(payload)
+            self.written_generation = generation
+            self.writes += 1
+
+    def _replace(self, text):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".data-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.filename)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def get_setting(self, setting, default=None):
+        return self.data['settings'].get(setting, default)
+
+    def set_setting(self, setting, value):
+        self.data['settings'][setting] = value
+        self.save_data()
+
+    def get_questions(self):
+        return list(self.quotes.values())
+
+    def add_question(self, question, answer):
+        entry = {"question": question, "answer": answer}
+        self.quotes[id(entry)] = entry
+        self.save_data()
+        return entry
+
+    def add_questions(self, pairs):
+        entries = [{"question": question, "answer": answer} for question, answer in pairs]
+        if entries:
+            self.quotes.update((id(entry), entry) for entry in entries)
+            self.save_data()
+        return entries
+
+    def remove_question(self, entry):
+        if self.quotes.pop(id(entry), None) is None:
+            return False
+        self.save_data()
+        return True
+
+    def get_whitelist(self):
+        return self.data['whitelist']
+
+    def add_whitelist(self, userid):
+        self.data['whitelist'].append(int(userid))
+        self.save_data()
+
+    def remove_whitelist(self, userid):
+        self.data['whitelist'].remove(int(userid))
+        self.save_data()
+
+    def get_inventory(self, userid):
+        inventory = self.users.get(userid)
+        return inventory if inventory is not None else Inventory()
+
+    def add_item(self, userid, card_id, amount=1):
+        inventory = self.users.get(userid)
+        if inventory is None:
+            inventory = self.users[userid] = Inventory()
+        inventory.add(card_id, amount)
+        self.save_data()
+
+    def remove_item(self, userid, card_id, delete_all=False):
+        inventory = self.users.get(userid)
+        if inventory is None:
+            return 0
+
+        # when the amount reaches 0 the entry is deleted
+        removed = inventory.remove(card_id, None if delete_all else 1)
+        if removed:
+            if not inventory:
+                del self.users[userid]
+            self.save_data()
+        return removed
+
+    def _move(self, inventory, moves):
+        deleted = 0
+        for old, new in moves.items():
+            amount = inventory.remove(old)
+            if new is None:
+                deleted += amount
+            elif amount:
+                inventory.add(new, amount)
+        return deleted
+
+    def move_items(self, userid, moves):
+        inventory = self.users.get(userid)
+        if inventory is None:
+            return 0
+
+        deleted = self._move(inventory, moves)
+        if not inventory:
+            del self.users[userid]
+        self.save_data()
+        return deleted
+
+    def move_items_everywhere(self, moves, userids=None):
+        changed = {}
+        users = self.users.items() if userids is None else ((userid, self.users.get(userid)) for userid in userids)
+        for userid, inventory in list(users):
+            if inventory is None:
+                continue
+            stale = dict((card_id, moves[card_id]) for card_id in inventory if card_id in moves)
+            if not stale:
+                continue
+            changed[userid] = self._move(inventory, stale)
+            if not inventory:
+                del self.users[userid]
+
+        if changed:
+            self.save_data()
+        return changed
+
+    def get_items(self):
+        return set().union(*self.users.values())
+
+    def get_users(self):
+        return self.users
+
+    def get_media(self):
+        return dict((int(card_id), tuple(entry)) for card_id, entry in self.data['media'].items())
+
+    def set_media(self, card_id, url, expires):
+        self.data['media'][str(card_id)] = [url, expires]
+        self.save_data()
+
+    def remove_media(self, card_id):
+        if self.data['media'].pop(str(card_id), None) is not None:
+            self.save_data()
+
+
+class UserIndex:
+    """Where every user's inventory is in a users file.
+
+    The users file holds one json array per inventory, appended on every save.
+    The index file next to it starts with a sorted base: the count, then arrays of
+    user ids, offsets, lengths and totals. Journal records of (user id, offset,
+    length, total) are appended to it after every save, the latest one wins.
+    A length of 0 marks a user without items. User ids must be numeric."""
+
+    RECORD = struct.Struct("<QQII")
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.index_file = os.path.splitext(data_file)[0] + ".idx"
+        self.ids = array('Q')
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.totals = array('I')
+        # user id -> (offset, length, total) of records newer than the base
+        self.journal = {}
+        # journal records in the file, outdated ones included
+        self.records = 0
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "rb") as f:
+                count = array('Q')
+                count.fromfile(f, 1)
+                for column in (self.ids, self.offsets, self.lengths, self.totals):
+                    column.fromfile(f, count[0])
+                base_size = f.tell()
+                tail = f.read()
+            usable = len(tail) - len(tail) % self.RECORD.size
+            for userid, offset, length, total in self.RECORD.iter_unpack(tail[:usable]):
+                self.journal[userid] = (offset, length, total)
+            self.records = usable // self.RECORD.size
+            if usable < len(tail):
+                # half written record of a crash, appending after it would misalign the rest
+                os.truncate(self.index_file, base_size + usable)
+        else:
+            with open(self.index_file, "wb") as f:
+                array('Q', [0]).tofile(f)
+        self.fd = os.open(self.data_file, os.O_RDWR | os.O_CREAT, 0o644)
+        self.end = os.fstat(self.fd).st_size
+
+    def close(self):
+        os.close(self.fd)
+
+    def find(self, userid):
+        """:returns (offset, length, total) of a user or None"""
+        userid = int(userid)
+        entry = self.journal.get(userid)
+        if entry is not None:
+            return entry
+        i = bisect_left(self.ids, userid)
+        if i < len(self.ids) and self.ids[i] == userid:
+            return self.offsets[i], self.lengths[i], self.totals[i]
+        return None
+
+    def read(self, userid):
+        """:returns Inventory of a user, empty if the user has nothing"""
+        entry = self.find(userid)
+        if entry is None or not entry[1]:
+            return Inventory()
+        return Inventory.from_list(json.loads(os.pread(self.fd, entry[1], entry[0])))
+
+    def entries(self):
+        """Yield (user id, offset, length, total) of every user with items"""
+        # the writer thread may append while the loop iterates
+        journal = dict(self.journal)
+        for userid, offset, length, total in zip(self.ids, self.offsets, self.lengths, self.totals):
+            if userid not in journal and length:
+                yield userid, offset, length, total
+        for userid, (offset, length, total) in journal.items():
+            if length:
+                yield userid, offset, length, total
+
+    def __iter__(self):
+        return (str(userid) for userid, _, _, _ in self.entries())
+
+    def append(self, records):
+        """Store new inventories
+        :param records: list of (userid, encoded inventory, total)"""
+        if not records:
+            return
+        payload = b"".join(data for _, data, _ in records)
+        os.pwrite(self.fd, payload, self.end)
+        os.fsync(self.fd)
+        journal = []
+        offset = self.end
+        for userid, data, total in records:
+            journal.append((int(userid), offset, len(data), total))
+            offset += len(data)
+        with open(self.index_file, "ab") as f:
+            f.write(b"".join(self.RECORD.pack(*entry) for entry in journal))
+            f.flush()
+            os.fsync(f.fileno())
+        self.end = offset
+        self.records += len(journal)
+        for userid, offset, length, total in journal:
+            self.journal[userid] = (offset, length, total)
+
+    def needs_compaction(self):
+        return self.records > max(COMPACT_MIN_RECORDS, COMPACT_RATIO * len(self.ids))
+
+    def compact(self, data_file):
+        """Copy every current inventory into a fresh pair of files with no journal
+        :returns UserIndex of the new files"""
+        rows = ((userid, os.pread(self.fd, length, offset), total)
+                for userid, offset, length, total in sorted(self.entries()))
+        return UserIndex.create(data_file, rows)
+
+    @staticmethod
+    def create(data_file, rows):
+        """Write a users file and its index
+        :param rows: (userid, encoded inventory, total) sorted by numeric userid
+        :returns UserIndex of the new files"""
+        ids, offsets, lengths, totals = array('Q'), array('Q'), array('I'), array('I')
+        position = 0
+        with open(data_file, "wb") as f:
+            for userid, data, total in rows:
+                f.write(data)
+                ids.append(int(userid))
+                offsets.append(position)
+                lengths.append(len(data))
+                totals.append(total)
+                position += len(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.splitext(data_file)[0] + ".idx", "wb") as f:
+            array('Q', [len(ids)]).tofile(f)
+            for column in (ids, offsets, lengths, totals):
+                column.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        return UserIndex(data_file)
+
+
+class LazyJSONStorage(JSONStorage):
+    """JSONStorage that keeps inventories out of data.json, in a users file with an index.
+    Startup only reads the index and a user's inventory is read the first time it's used.
+    Saves append the changed inventories instead of rewriting every user.
+    An existing data.json is split into these files on its first start."""
+
+    def load_users(self, users, users_file):
+        # loaded inventories, least recently used first
+        self.users = collections.OrderedDict()
+        self.dirty = set()
+        # userid -> generation of its last change, and of its last appended record,
+        # inventories with unwritten changes are never dropped from memory
+        self.modified = {}
+        self.written = {}
+        self.retired = None
+
+        self.users_file = users_file or USERS_FILE
+        self._remove_orphans()
+        if users_file is not None:
+            self.index = UserIndex(self.path(self.users_file))
+        else:
+            rows = ((userid, self._encode(inventory), inventory.total())
+                    for userid, inventory in sorted(users.items(), key=lambda item: int(item[0])))
+            self.index = UserIndex.create(self.path(self.users_file), rows)
+            print(f"Moved {len(users)} inventories from {self.filename} to {self.users_file}")
+            self.save_data()
+
+    def _remove_orphans(self):
+        """Delete users files data.json doesn't point to, left by a crash during compaction"""
+        stem = os.path.splitext(USERS_FILE)[0]
+        current = os.path.splitext(self.users_file)[0]
+        for name in os.listdir(os.path.dirname(self.path(self.users_file))):
+            base, extension = os.path.splitext(name)
+            if extension not in (".dat", ".idx") or base == current:
+                continue
+            if base == stem or (base.startswith(stem + "-") and base[len(stem) + 1:].isdigit()):
+                print(f"Removing {name}, left over from an interrupted compaction")
+                os.remove(self.path(name))
+
+    @staticmethod
+    def _encode(inventory):
+        return json.dumps(inventory.to_list(), separators=(',', ':')).encode() if inventory else b""
+
+    def _load(self, userid):
+        inventory = self.users.get(userid)
+        if inventory is None:
+            inventory = self.index.read(userid)
+            self.users[userid] = inventory
+            self._evict()
+        else:
+            self.users.move_to_end(userid)
+        return inventory
+
+    def _evict(self):
+        attempts = len(self.users) - LAZY_CACHE_USERS
+        while attempts > 0:
+            attempts -= 1
+            userid, inventory = self.users.popitem(last=False)
+            if self.written.get(userid, -1) < self.modified.get(userid, -1):
+                self.users[userid] = inventory
+            else:
+                self.modified.pop(userid, None)
+
+    def _changed(self, userid):
+        self.dirty.add(userid)
+        # save_data is called right after and bumps the generation
+        self.modified[userid] = self.generation + 1
+        self.save_data()
+
+    def _serialize(self):
+        with metrics.registry.timer("storage_serialize"):
+            self.pending = 0
+            data = dict(self.data)
+            data['cards'] = [self.cards.paths.get(card_id) for card_id in range(self.cards.next_id)]
+            data['quotes'] = list(self.quotes.values())
+            text = json.dumps(data, separators=(',', ':'))
+            records = [(userid, self._encode(self.users[userid]), self.users[userid].total())
+                       for userid in self.dirty]
+            self.dirty = set()
+            return text, records
+
+    def _write(self, payload, generation):
+        """Append the changed inventories and replace data.json. An older snapshot arriving
+        late still appends the users it has, unless they were written by a newer one since."""
+        text, records = payload
+        with self.write_lock, metrics.registry.timer("storage_write"):
+            records = [record for record in records if self.written.get(record[0], -1) < generation]
+            try:
+                self.index.append(records)
+            except OSError:
+                # serialized again on the retry
+                self.dirty.update(userid for userid, _, _ in records)
+                raise
+            for userid, _, _ in records:
+                self.written[userid] = generation
+
+            old_file = None
+            if self.index.needs_compaction():
+                old_file = self.users_file
+                self.users_file = f"{os.path.splitext(USERS_FILE)[0]}-{int(time.time() * 1000)}.dat"
+                if self.retired is not None:
+                    self.retired.close()
+                self.retired, self.index = self.index, self.index.compact(self.path(self.users_file))
+
+            if generation >= self.written_generation:
+                self.data_text = text
+                self.written_generation = generation
+            elif old_file is None:
+                return
+            self._replace(self.data_text[:-1] + f',"users_file":{json.dumps(self.users_file)}}}')
+            self.writes += 1
+
+            if old_file is not None:
+                for filename in (old_file, os.path.splitext(old_file)[0] + ".idx"):
+                    try:
+                        os.remove(self.path(filename))
+                    except FileNotFoundError:
+                        pass
+
+    def get_inventory(self, userid):
+        return self._load(userid)
+
+    def add_item(self, userid, card_id, amount=1):
+        self._load(userid).add(card_id, amount)
+        self._changed(userid)
+
+    def remove_item(self, userid, card_id, delete_all=False):
+        removed = self._load(userid).remove(card_id, None if delete_all else 1)
+        if removed:
+            self._changed(userid)
+        return removed
+
+    def move_items(self, userid, moves):
+        inventory = self._load(userid)
+        if not inventory:
+            return 0
+        deleted = self._move(inventory, moves)
+        self._changed(userid)
+        return deleted
+
+    def move_items_everywhere(self, moves, userids=None):
+        changed = {}
+        for userid in list(self._userids() if userids is None else userids):
+            inventory = self._load(userid)
+            stale = dict((card_id, moves[card_id]) for card_id in inventory if card_id in moves)
+            if stale:
+                changed[userid] = self._move(inventory, stale)
+                self.dirty.add(userid)
+                self.modified[userid] = self.generation + 1
+        if changed:
+            self.save_data()
+        return changed
+
+    def _userids(self):
+        return set(self.index) | set(userid for userid, inventory in self.users.items() if inventory)
+
+    def _peek(self, userid):
+        """Inventory of a user without keeping it in memory"""
+        inventory = self.users.get(userid)
+        return inventory if inventory is not None else self.index.read(userid)
+
+    def get_items(self):
+        return set().union(*(self._peek(userid) for userid in self._userids()))
+
+    def get_users(self):
+        users = dict((userid, self._peek(userid)) for userid in self._userids())
+        return dict((userid, inventory) for userid, inventory in users.items() if inventory)
+
+    def get_totals(self):
+        totals = dict((str(userid), total) for userid, _, _, total in self.index.entries())
+        for userid, inventory in self.users.items():
+            if inventory:
+                totals[userid] = inventory.total()
+            else:
+                totals.pop(userid, None)
+        return totals
+
+
+class SQLiteStorage(Storage):
+    """Normalized tables in an sqlite database running in WAL mode.
+    Every change is a single row statement instead of a full rewrite."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            -- question.casefold(), COLLATE NOCASE only folds ascii
+            folded TEXT
+        );
+        CREATE TABLE IF NOT EXISTS whitelist (
+            user_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS cards (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS inventory (
+            user_id TEXT NOT NULL,
+            card_id INTEGER NOT NULL REFERENCES cards (id),
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (user_id, card_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS inventory_card ON inventory (card_id);
+        CREATE TABLE IF NOT EXISTS media (
+            card_id INTEGER PRIMARY KEY REFERENCES cards (id),
+            url TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+
+        -- change tracking so every process sharing the database can pick up the others' changes
+        CREATE TABLE IF NOT EXISTS revisions (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO revisions (name, value) VALUES ('settings', 0), ('questions', 0), ('cards', 0);
+        CREATE TRIGGER IF NOT EXISTS settings_insert AFTER INSERT ON settings
+            BEGIN UPDATE revisions SET value = value + 1 WHERE name = 'settings'; END;
+        CREATE TRIGGER IF NOT EXISTS settings_update AFTER UPDATE ON settings
+            BEGIN UPDATE revisions SET value = value + 1 WHERE name = 'settings'; END;
+        CREATE TRIGGER IF NOT EXISTS settings_delete AFTER DELETE ON settings
+            BEGIN UPDATE revisions SET value = value + 1 WHERE name = 'settings'; END;
+        CREATE TRIGGER IF NOT EXISTS questions_insert AFTER INSERT ON questions
+            BEGIN UPDATE revisions SET value = value + 1 WHERE name = 'questions'; END;
+        CREATE TRIGGER IF NOT EXISTS questions_delete AFTER DELETE ON questions
+            BEGIN UPDATE revisions SET value = value + 1 WHERE name = 'questions'; END;
+        CREATE TRIGGER IF NOT EXISTS cards_insert AFTER INSERT ON cards
+            BEGIN UPDATE revisions SET value = value + 1 WHERE name = 'cards'; END;
+        CREATE TABLE IF NOT EXISTS inventory_changes (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created REAL NOT NULL DEFAULT (julianday('now'))
+        );
+        CREATE TRIGGER IF NOT EXISTS inventory_insert AFTER INSERT ON inventory
+            BEGIN INSERT INTO inventory_changes (user_id) VALUES (new.user_id); END;
+        CREATE TRIGGER IF NOT EXISTS inventory_update AFTER UPDATE ON inventory
+            BEGIN INSERT INTO inventory_changes (user_id) VALUES (new.user_id); END;
+        CREATE TRIGGER IF NOT EXISTS inventory_delete AFTER DELETE ON inventory
+            BEGIN INSERT INTO inventory_changes (user_id) VALUES (old.user_id); END;
+    """
+
+    shared = True
+
+    def __init__(self, filename=SQLITE_FILE):
+        self.filename = filename
+        # autocommit, every statement is its own transaction unless grouped explicitly
+        self.conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        # wait for other processes' writes instead of failing with "database is locked"
+        self.conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+        self.conn.executescript(self.SCHEMA)
+        self._add_folded_questions()
+        self.cards = CardRegistry(dict(self.conn.execute("SELECT id, path FROM cards")),
+                                  on_add=self._add_card, on_miss=self._find_card)
+
+        self.data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        self.revisions = dict(self.conn.execute("SELECT name, value FROM revisions"))
+        self.last_change = self.conn.execute("SELECT coalesce(max(id), 0) FROM inventory_changes").fetchone()[0]
+        self.last_prune = time.monotonic()
+        atexit.register(self.close)
+
+    def _add_folded_questions(self):
+        """Give databases from before the folded column one, and index it"""
+        with self.transaction() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(questions)")]
+            if 'folded' not in columns:
+                conn.execute("ALTER TABLE questions ADD COLUMN folded TEXT")
+            conn.executemany("UPDATE questions SET folded = ? WHERE id = ?",
+                             ((question.casefold(), qid) for qid, question in
+                              conn.execute("SELECT id, question FROM questions WHERE folded IS NULL").fetchall()))
+            conn.execute("DROP INDEX IF EXISTS questions_question")
+            conn.execute("CREATE INDEX IF NOT EXISTS questions_folded ON questions (folded)")
+
+    def _add_card(self, card_id, path):
+        # the database picks the id, another process may have added cards we don't know yet
+        self.conn.execute("INSERT OR IGNORE INTO cards (path) VALUES (?)", (path,))
+        return self.conn.execute("SELECT id FROM cards WHERE path = ?", (path,)).fetchone()[0]
+
+    def _find_card(self, card_id):
+        row = self.conn.execute("SELECT path FROM cards WHERE id = ?", (card_id,)).fetchone()
+        return None if row is None else row[0]
+
+    def poll_changes(self):
+        # on its own timer, a single process never sees data_version change
+        self._prune_changes()
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.data_version:
+            return None
+        self.data_version = version
+
+        revisions = dict(self.conn.execute("SELECT name, value FROM revisions"))
+        sections = set(name for name, value in revisions.items() if self.revisions.get(name) != value)
+        self.revisions = revisions
+        if 'cards' in sections:
+            self.cards.load(self.conn.execute("SELECT id, path FROM cards WHERE id >= 0"))
+
+        users = set()
+        for change_id, userid in self.conn.execute("SELECT id, user_id FROM inventory_changes WHERE id > ?",
+                                                   (self.last_change,)):
+            users.add(userid)
+            self.last_change = change_id
+        return sections, users
+
+    def _prune_changes(self):
+        """Drop inventory changes older than CHANGE_RETENTION, at most once per CHANGE_RETENTION"""
+        now = time.monotonic()
+        if now - self.last_prune < CHANGE_RETENTION:
+            return
+        self.last_prune = now
+        self.conn.execute("DELETE FROM inventory_changes WHERE created < julianday('now') - ?",
+                          (CHANGE_RETENTION / 86400,))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        start = time.perf_counter()
+        # take the write lock up front, a deferred transaction that reads first can't
+        # always upgrade to a write while another process is writing
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        metrics.registry.observe("storage_transaction", time.perf_counter() - start)
+
+    def get_setting(self, setting, default=None):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (setting,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set_setting(self, setting, value):
+        self.conn.execute("INSERT INTO settings (key, value) VALUES (?, ?) "
+                          "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                          (setting, json.dumps(value)))
+
+    def update_setting(self, setting, function, default=None):
+        with self.transaction():
+            value = function(self.get_setting(setting, default))
+            self.set_setting(setting, value)
+        return value
+
+    def get_questions(self):
+        return [{"question": q, "answer": a}
+                for q, a in self.conn.execute("SELECT question, answer FROM questions ORDER BY id")]
+
+    def add_question(self, question, answer):
+        self.conn.execute("INSERT INTO questions (question, answer, folded) VALUES (?, ?, ?)",
+                          (question, answer, question.casefold()))
+        return {"question": question, "answer": answer}
+
+    def add_questions(self, pairs):
+        entries = [{"question": question, "answer": answer} for question, answer in pairs]
+        with self.transaction() as conn:
+            conn.executemany("INSERT INTO questions (question, answer, folded) VALUES (?, ?, ?)",
+                             ((entry['question'], entry['answer'], entry['question'].casefold())
+                              for entry in entries))
+        return entries
+
+    def remove_question(self, entry):
+        row = self.conn.execute("SELECT id FROM questions WHERE folded = ? AND answer = ? ORDER BY id LIMIT 1",
+                                (entry['question'].casefold(), entry['answer'])).fetchone()
+        if row is None:
+            return False
+        self.conn.execute("DELETE FROM questions WHERE id = ?", row)
+        return True
+
+    def get_whitelist(self):
+        return [user_id for user_id, in self.conn.execute("SELECT user_id FROM whitelist")]
+
+    def add_whitelist(self, userid):
+        self.conn.execute("INSERT OR IGNORE INTO whitelist (user_id) VALUES (?)", (int(userid),))
+
+    def remove_whitelist(self, userid):
+        self.conn.execute("DELETE FROM whitelist WHERE user_id = ?", (int(userid),))
+
+    def get_inventory(self, userid):
+        return Inventory(self.conn.execute("SELECT card_id, amount FROM inventory WHERE user_id = ?", (userid,)))
+
+    def add_item(self, userid, card_id, amount=1):
+        self.conn.execute("INSERT INTO inventory (user_id, card_id, amount) VALUES (?, ?, ?) "
+                          "ON CONFLICT (user_id, card_id) DO UPDATE SET amount = amount + excluded.amount",
+                          (userid, card_id, amount))
+
+    def remove_item(self, userid, card_id, delete_all=False):
+        with self.transaction():
+            row = self.conn.execute("SELECT amount FROM inventory WHERE user_id = ? AND card_id = ?",
+                                    (userid, card_id)).fetchone()
+            if row is None:
+                return 0
+
+            if delete_all or row[0] <= 1:
+                # if 0 or less, cleanup and delete entry
+                self.conn.execute("DELETE FROM inventory WHERE user_id = ? AND card_id = ?", (userid, card_id))
+            else:
+                self.conn.execute("UPDATE inventory SET amount = amount - 1 WHERE user_id = ? AND card_id = ?",
+                                  (userid, card_id))
+        return row[0] if delete_all else 1
+
+    def move_items(self, userid, moves):
+        with self.transaction():
+            deleted = self._move_user(userid, moves)
+        return deleted or 0
+
+    def _move_user(self, userid, moves):
+        """:returns how many items were deleted, None if the user had none of the cards"""
+        deleted = None
+        for old, new in moves.items():
+            row = self.conn.execute("SELECT amount FROM inventory WHERE user_id = ? AND card_id = ?",
+                                    (userid, old)).fetchone()
+            if row is None:
+                continue
+            deleted = deleted or 0
+            self.conn.execute("DELETE FROM inventory WHERE user_id = ? AND card_id = ?", (userid, old))
+            if new is None:
+                deleted += row[0]
+            else:
+                self.conn.execute("INSERT INTO inventory (user_id, card_id, amount) VALUES (?, ?, ?) "
+                                  "ON CONFLICT (user_id, card_id) DO UPDATE SET amount = amount + excluded.amount",
+                                  (userid, new, row[0]))
+        return deleted
+
+    def move_items_everywhere(self, moves, userids=None):
+        changed = {}
+        with self.transaction():
+            if userids is not None:
+                for userid in userids:
+                    deleted = self._move_user(userid, moves)
+                    if deleted is not None:
+                        changed[userid] = deleted
+                return changed
+            for old, new in moves.items():
+                rows = self.conn.execute("SELECT user_id, amount FROM inventory WHERE card_id = ?",
+                                         (old,)).fetchall()
+                if not rows:
+                    continue
+                if new is None:
+                    for userid, amount in rows:
+                        changed[userid] = changed.get(userid, 0) + amount
+                else:
+                    self.conn.execute("INSERT INTO inventory (user_id, card_id, amount) "
+                                      "SELECT user_id, ?, amount FROM inventory WHERE card_id = ? "
+                                      "ON CONFLICT (user_id, card_id) DO UPDATE SET amount = amount + excluded.amount",
+                                      (new, old))
+                    for userid, _ in rows:
+                        changed.setdefault(userid, 0)
+                self.conn.execute("DELETE FROM inventory WHERE card_id = ?", (old,))
+        return changed
+
+    def get_items(self):
+        return set(card_id for card_id, in self.conn.execute("SELECT DISTINCT card_id FROM inventory"))
+
+    def get_totals(self):
+        return dict(self.conn.execute("SELECT user_id, sum(amount) FROM inventory GROUP BY user_id"))
+
+    def get_users(self):
+        rows = {}
+        for userid, card_id, amount in self.conn.execute("SELECT user_id, card_id, amount FROM inventory"):
+            rows.setdefault(userid, []).append((card_id, amount))
+        return dict((userid, Inventory(pairs)) for userid, pairs in rows.items())
+
+    def get_media(self):
+        return dict((card_id, (url, expires))
+                    for card_id, url, expires in self.conn.execute("SELECT card_id, url, expires FROM media"))
+
+    def set_media(self, card_id, url, expires):
+        self.conn.execute("INSERT OR REPLACE INTO media (card_id, url, expires) VALUES (?, ?, ?)",
+                          (card_id, url, expires))
+
+    def remove_media(self, card_id):
+        self.conn.execute("DELETE FROM media WHERE card_id = ?", (card_id,))
+
+    def close(self):
+        self.conn.close()
+
+
+def open_storage(kind):
+    """Create the storage backend called [kind]"""
+    if kind == "json":
+        return JSONStorage()
+    elif kind == "lazy":
+        return LazyJSONStorage()
+    elif kind == "sqlite":
+        return SQLiteStorage()
+    else:
+        raise ValueError(f"Unknown storage backend {kind}")
+
+
+def migrate(json_file=DATA_FILE, sqlite_file=SQLITE_FILE):
+    """Import an existing json data file into an sqlite database in one transaction"""
+    source = JSONStorage(json_file)
+    target = SQLiteStorage(sqlite_file)
+    with target.transaction() as conn:
+        # importing on top of earlier rows would add every inventory and question again
+        filled = [table for table in ("settings", "questions", "whitelist", "inventory", "media")
+                  if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is not None]
+        if not filled:
+            rows = migrate_rows(source, target, conn)
+    target.close()
+
+    if filled:
+        print(f"{sqlite_file} already has {', '.join(filled)}, not migrating {json_file} again")
+        return False
+    print(f"Migrated {len(source.get_users())} users ({rows} inventory rows), "
+          f"{len(source.get_questions())} questions and {len(source.get_whitelist())} whitelisted users "
+          f"from {json_file} to {sqlite_file}")
+    return True
+
+
+def migrate_rows(source, target, conn):
+    """Copy everything from a JSONStorage into the open transaction of an empty SQLiteStorage
+    :returns how many inventory rows were copied"""
+    for setting, value in source.data['settings'].items():
+        conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (setting, json.dumps(value)))
+    conn.executemany("INSERT INTO questions (question, answer, folded) VALUES (?, ?, ?)",
+                     ((q.get('question'), q.get('answer'), q.get('question').casefold())
+                      for q in source.get_questions()))
+    conn.executemany("INSERT OR IGNORE INTO whitelist (user_id) VALUES (?)",
+                     ((int(userid),) for userid in source.get_whitelist()))
+    rows = 0
+    for userid, inventory in source.get_users().items():
+        entries = [(userid, target.cards.id(source.cards.path(card_id)), amount)
+                   for card_id, amount in inventory.items()]
+        conn.executemany("INSERT INTO inventory (user_id, card_id, amount) VALUES (?, ?, ?) "
+                         "ON CONFLICT (user_id, card_id) DO UPDATE SET amount = amount + excluded.amount",
+                         entries)
+        rows += len(entries)
+    # nobody is running on the new database yet, no need to tell them about the import
+    conn.execute("DELETE FROM inventory_changes")
+    conn.executemany("INSERT OR REPLACE INTO media (card_id, url, expires) VALUES (?, ?, ?)",
+                     ((target.cards.id(source.cards.path(card_id)), url, expires)
+                      for card_id, (url, expires) in source.get_media().items()))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storage maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="import a json data file into sqlite")
+    migrate_parser.add_argument("json_file", nargs="?", default=DATA_FILE)
+    migrate_parser.add_argument("sqlite_file", nargs="?", default=SQLITE_FILE)
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        sys.exit(0 if migrate(args.json_file, args.sqlite_file) else 1)
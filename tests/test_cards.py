@@ -0,0 +1,150 @@
+# Author : Joinemm
+# File   : tests/test_cards.py
+
+"""Card id registry and the flat array inventories every user is stored in.
+
+    python -m pytest tests
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from cards import CardRegistry, Inventory  # noqa: E402
+
+
+class InventoryTest(unittest.TestCase):
+
+    def test_add_and_remove(self):
+        inventory = Inventory()
+        self.assertFalse(inventory)
+        inventory.add(5)
+        inventory.add(2, 3)
+        inventory.add(9)
+        inventory.add(5, 2)
+        self.assertEqual(list(inventory.items()), [(2, 3), (5, 3), (9, 1)])
+        self.assertEqual(list(inventory), [2, 5, 9])
+        self.assertEqual(len(inventory), 3)
+        self.assertEqual(inventory.total(), 7)
+        self.assertIn(9, inventory)
+        self.assertNotIn(3, inventory)
+        self.assertEqual(inventory.get(5), 3)
+        self.assertEqual(inventory.get(3), 0)
+
+        self.assertEqual(inventory.remove(5, 1), 1)
+        self.assertEqual(inventory.get(5), 2)
+        self.assertEqual(inventory.remove(2, 10), 3)
+        self.assertEqual(inventory.remove(2), 0)
+        self.assertEqual(inventory.remove(9), 1)
+        self.assertEqual(list(inventory.items()), [(5, 2)])
+        self.assertEqual(inventory.remove(5), 2)
+        self.assertFalse(inventory)
+        self.assertEqual(inventory.total(), 0)
+
+    def test_matches_a_dict(self):
+        rng = random.Random(0)
+        inventory = Inventory()
+        expected = {}
+        for _ in range(5000):
+            card_id = rng.randrange(50)
+            if rng.random() < 0.6:
+                amount = rng.randrange(1, 4)
+                inventory.add(card_id, amount)
+                expected[card_id] = expected.get(card_id, 0) + amount
+            else:
+                amount = rng.choice((None, 1, 2))
+                owned = expected.get(card_id, 0)
+                removed = owned if amount is None else min(amount, owned)
+                self.assertEqual(inventory.remove(card_id, amount), removed)
+                if owned:
+                    expected[card_id] = owned - removed
+                    if not expected[card_id]:
+                        del expected[card_id]
+            self.assertEqual(len(inventory), len(expected))
+        self.assertEqual(dict(inventory.items()), expected)
+        self.assertEqual(list(inventory), sorted(expected))
+        self.assertEqual(inventory.total(), sum(expected.values()))
+
+    def test_list_round_trip(self):
+        inventory = Inventory([(9, 1), (2, 3), (5, 2)])
+        flat = inventory.to_list()
+        self.assertEqual(flat, [2, 5, 9, 3, 2, 1])
+        restored = Inventory.from_list(json.loads(json.dumps(flat)))
+        self.assertIsInstance(restored, Inventory)
+        self.assertEqual(restored, inventory)
+        self.assertEqual(list(restored.items()), [(2, 3), (5, 2), (9, 1)])
+        self.assertEqual(Inventory.from_list([]), Inventory())
+        self.assertNotEqual(inventory, inventory.to_list())
+
+
+class CardRegistryTest(unittest.TestCase):
+
+    def test_ids(self):
+        registry = CardRegistry({0: "img/10/a.jpg", 4: "img/10/b.jpg"})
+        self.assertEqual(registry.id("img/10/b.jpg"), 4)
+        self.assertEqual(registry.id("img/10/c.jpg"), 5)
+        self.assertEqual(registry.get_id("img/10/c.jpg"), 5)
+        self.assertIsNone(registry.get_id("img/10/d.jpg"))
+        self.assertEqual(registry.path(0), "img/10/a.jpg")
+        self.assertEqual(len(registry), 3)
+        with self.assertRaises(KeyError):
+            registry.path(1)
+
+    def test_on_add_assigns_the_id(self):
+        added = []
+
+        def on_add(card_id, path):
+            added.append((card_id, path))
+            return 10
+
+        registry = CardRegistry(on_add=on_add)
+        self.assertEqual(registry.id("img/10/a.jpg"), 10)
+        self.assertEqual(registry.id("img/10/a.jpg"), 10)
+        self.assertEqual(added, [(0, "img/10/a.jpg")])
+
+    def test_on_miss_finds_other_processes_ids(self):
+        known = {7: "img/10/a.jpg"}
+        registry = CardRegistry(on_miss=known.get)
+        self.assertEqual(registry.path(7), "img/10/a.jpg")
+        self.assertEqual(registry.get_id("img/10/a.jpg"), 7)
+        self.assertEqual(registry.id("img/10/b.jpg"), 8)
+        with self.assertRaises(KeyError):
+            registry.path(3)
+
+
+class LegacyInventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="collector-test-")
+        self.filename = os.path.join(self.directory, "data.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_path_keyed_users(self):
+        with open(self.filename, "w") as f:
+            json.dump({"users": {"1": {"img/10/a.jpg": 2, "img/5/b.jpg": 1}, "2": {"img/5/b.jpg": 4}}}, f)
+        store = storage.JSONStorage(self.filename, durability="sync")
+        paths = dict((userid, dict((store.cards.path(card_id), amount) for card_id, amount in inventory.items()))
+                     for userid, inventory in store.get_users().items())
+        self.assertEqual(paths, {"1": {"img/10/a.jpg": 2, "img/5/b.jpg": 1}, "2": {"img/5/b.jpg": 4}})
+
+        # the next save writes card ids and flat arrays
+        store.add_item("2", store.cards.id("img/10/a.jpg"))
+        with open(self.filename) as f:
+            data = json.load(f)
+        self.assertEqual(len(data['cards']), 2)
+        self.assertEqual(data['users']['1'], store.get_inventory("1").to_list())
+        reopened = storage.JSONStorage(self.filename, durability="sync")
+        self.assertEqual(reopened.get_users(), store.get_users())
+
+
+if __name__ == "__main__":
+    unittest.main()
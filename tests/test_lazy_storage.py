@@ -0,0 +1,222 @@
+# Author : Joinemm
+# File   : tests/test_lazy_storage.py
+
+"""Recovery paths of the lazy backend's users files.
+
+    python -m pytest tests
+"""
+
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from cards import Inventory  # noqa: E402
+
+
+def encode(items):
+    inventory = Inventory(items.items())
+    return storage.LazyJSONStorage._encode(inventory), inventory.total()
+
+
+class UserIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="collector-test-")
+        self.data_file = os.path.join(self.directory, "users.dat")
+        self.expected = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, index, changes):
+        records = []
+        for userid, items in changes.items():
+            data, total = encode(items)
+            records.append((userid, data, total))
+            if items:
+                self.expected[userid] = items
+            else:
+                self.expected.pop(userid, None)
+        index.append(records)
+
+    def check(self, index):
+        self.assertEqual(set(index), set(self.expected))
+        for userid, items in self.expected.items():
+            self.assertEqual(dict(index.read(userid).items()), items)
+            self.assertEqual(index.find(userid)[2], sum(items.values()))
+        self.assertFalse(index.read("999"))
+
+    def test_append_and_reopen(self):
+        rows = [(str(userid), *encode({1: userid, 2: 1})) for userid in range(100, 110)]
+        self.expected = dict((str(userid), {1: userid, 2: 1}) for userid in range(100, 110))
+        index = storage.UserIndex.create(self.data_file, rows)
+        self.store(index, {"105": {3: 7}, "200": {1: 1}, "101": {}})
+        self.store(index, {"105": {3: 8, 4: 1}})
+        self.check(index)
+        index.close()
+
+        index = storage.UserIndex(self.data_file)
+        self.assertEqual(index.records, 4)
+        self.check(index)
+        index.close()
+
+    def test_torn_tail_record(self):
+        index = storage.UserIndex(self.data_file)
+        self.store(index, {"1": {1: 1}, "2": {2: 2}})
+        index.close()
+        size = os.path.getsize(index.index_file)
+        with open(index.index_file, "ab") as f:
+            f.write(storage.UserIndex.RECORD.pack(3, 0, 5, 1)[:10])
+
+        index = storage.UserIndex(self.data_file)
+        self.assertEqual(os.path.getsize(index.index_file), size)
+        self.check(index)
+        # appending after the truncation must line up with the records before it
+        self.store(index, {"3": {3: 3}})
+        index.close()
+        index = storage.UserIndex(self.data_file)
+        self.check(index)
+        index.close()
+
+    def test_compact(self):
+        index = storage.UserIndex(self.data_file)
+        for step in range(5):
+            self.store(index, dict((str(userid), {step: userid} if userid % 4 else {}) for userid in range(1, 50)))
+        compacted = index.compact(os.path.join(self.directory, "users-1.dat"))
+        index.close()
+        self.assertEqual(compacted.records, 0)
+        self.assertEqual(len(compacted.ids), len(self.expected))
+        self.check(compacted)
+        compacted.close()
+
+        reopened = storage.UserIndex(os.path.join(self.directory, "users-1.dat"))
+        self.check(reopened)
+        reopened.close()
+
+
+class LazyJSONStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="collector-test-")
+        self.filename = os.path.join(self.directory, "data.json")
+        self.settings = (storage.LAZY_CACHE_USERS, storage.COMPACT_MIN_RECORDS)
+        users = dict((str(userid), [1, 2, userid, 1]) for userid in range(1000, 1100))
+        with open(self.filename, "w") as f:
+            json.dump({"settings": {"frequency": [1, 2]}, "cards": ["a", "b", "c"], "users": users}, f)
+        self.expected = dict((userid, {1: int(userid), 2: 1}) for userid in users)
+
+    def tearDown(self):
+        storage.LAZY_CACHE_USERS, storage.COMPACT_MIN_RECORDS = self.settings
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return storage.LazyJSONStorage(self.filename)
+
+    def assert_users(self, store):
+        self.assertEqual(dict((userid, dict(inventory.items())) for userid, inventory in store.get_users().items()),
+                         self.expected)
+        self.assertEqual(store.get_totals(), dict((userid, sum(items.values()))
+                                                  for userid, items in self.expected.items()))
+
+    def users_files(self):
+        return sorted(name for name in os.listdir(self.directory) if name.startswith("users"))
+
+    def test_split_on_first_start(self):
+        store = self.open()
+        with open(self.filename) as f:
+            data = json.load(f)
+        self.assertNotIn('users', data)
+        self.assertEqual(data['users_file'], "users.dat")
+        self.assertEqual(data['settings'], {"frequency": [1, 2]})
+        self.assert_users(store)
+        self.assert_users(self.open())
+
+    def test_random_changes_with_compaction(self):
+        storage.LAZY_CACHE_USERS = 10
+        storage.COMPACT_MIN_RECORDS = 50
+        store = self.open()
+        rng = random.Random(0)
+        for _ in range(2000):
+            userid = str(rng.randrange(1000, 1150))
+            card_id = rng.randrange(3)
+            items = self.expected.setdefault(userid, {})
+            if rng.random() < 0.6:
+                store.add_item(userid, card_id)
+                items[card_id] = items.get(card_id, 0) + 1
+            else:
+                removed = store.remove_item(userid, card_id)
+                self.assertEqual(removed, 1 if card_id in items else 0)
+                if card_id in items:
+                    items[card_id] -= 1
+                    if not items[card_id]:
+                        del items[card_id]
+            if not items:
+                del self.expected[userid]
+        store.flush()
+
+        # compacted at least once, and only the current pair is left
+        with open(self.filename) as f:
+            users_file = json.load(f)['users_file']
+        self.assertNotEqual(users_file, "users.dat")
+        stem = os.path.splitext(users_file)[0]
+        self.assertEqual(self.users_files(), [stem + ".dat", stem + ".idx"])
+        self.assertLessEqual(len(store.users), storage.LAZY_CACHE_USERS)
+        self.assert_users(store)
+        self.assert_users(self.open())
+
+    def test_orphans_removed_on_start(self):
+        self.open()
+        for name in ("users-123.dat", "users-123.idx"):
+            open(os.path.join(self.directory, name), "wb").close()
+        open(os.path.join(self.directory, "users-notes.txt"), "wb").close()
+        store = self.open()
+        self.assertEqual(self.users_files(), ["users-notes.txt", "users.dat", "users.idx"])
+        self.assert_users(store)
+
+    def test_unwritten_users_are_never_evicted(self):
+        storage.LAZY_CACHE_USERS = 2
+        store = self.open()
+        # coalesce like the flusher does, instead of writing every change
+        store.wakeup = threading.Event()
+        store.flush_after = 10 ** 6
+        for userid in ("1000", "1001", "1002", "1003"):
+            store.add_item(userid, 0)
+            self.expected[userid][0] = 1
+        self.assertEqual(len(store.users), 4)
+
+        store.flush()
+        store.get_inventory("1050")
+        self.assertLessEqual(len(store.users), 2)
+        self.assert_users(store)
+        self.assert_users(self.open())
+
+    def test_late_snapshot(self):
+        store = self.open()
+        store.wakeup = threading.Event()
+        store.add_item("1000", 0)
+        store.add_item("1001", 0)
+        old = store._serialize(), store.generation
+        store.add_item("1000", 0, 5)
+        store.set_setting("frequency", [3, 4])
+        new = store._serialize(), store.generation
+
+        # the writer thread finished the newer snapshot first
+        store._write(*new)
+        store._write(*old)
+        self.expected["1000"][0] = 6
+        self.expected["1001"][0] = 1
+        self.assert_users(self.open())
+        with open(self.filename) as f:
+            self.assertEqual(json.load(f)['settings']['frequency'], [3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,240 @@
+# Author : Joinemm
+# File   : tests/test_storage.py
+
+"""Behaviour every storage backend shares, the sqlite schema and the json to sqlite migration.
+
+    python -m pytest tests
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+
+def items(inventory):
+    return dict(inventory.items())
+
+
+class BackendTests:
+    """Mixed into a TestCase per backend, open() returns a fresh connection to the same store"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="collector-test-")
+        self.filename = os.path.join(self.directory, self.FILENAME)
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            if isinstance(store, storage.SQLiteStorage):
+                store.close()
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        raise NotImplementedError
+
+    def test_settings(self):
+        store = self.open()
+        self.assertIsNone(store.get_setting('frequency'))
+        self.assertEqual(store.get_setting('frequency', [1, 2]), [1, 2])
+        store.set_setting('frequency', [3, 4])
+        self.assertEqual(store.update_setting('guilds', lambda guilds: dict(guilds, a=1), {}), {'a': 1})
+        reopened = self.open()
+        self.assertEqual(reopened.get_setting('frequency'), [3, 4])
+        self.assertEqual(reopened.get_setting('guilds'), {'a': 1})
+
+    def test_questions(self):
+        store = self.open()
+        first = store.add_question("Straße?", "a")
+        store.add_questions([("STRASSE?", "b"), ("other", "c")])
+        self.assertEqual(len(store.add_questions(iter(()))), 0)
+        self.assertTrue(store.remove_question(first))
+        self.assertFalse(store.remove_question(first))
+        self.assertEqual(store.get_questions(), [{"question": "STRASSE?", "answer": "b"},
+                                                 {"question": "other", "answer": "c"}])
+        self.assertEqual(self.open().get_questions(), store.get_questions())
+
+    def test_whitelist(self):
+        store = self.open()
+        store.add_whitelist("5")
+        store.add_whitelist(6)
+        store.remove_whitelist("5")
+        self.assertEqual(self.open().get_whitelist(), [6])
+
+    def test_items(self):
+        store = self.open()
+        a, b = store.cards.id("img/10/a.jpg"), store.cards.id("img/10/b.jpg")
+        store.add_item("1", a)
+        store.add_item("1", a, 2)
+        store.add_item("1", b)
+        store.add_item("2", b, 4)
+        self.assertEqual(store.remove_item("1", b), 1)
+        self.assertEqual(store.remove_item("1", b), 0)
+        self.assertEqual(store.remove_item("2", b), 1)
+        self.assertEqual(store.remove_item("2", b, delete_all=True), 3)
+        self.assertEqual(store.remove_item("3", a), 0)
+
+        reopened = self.open()
+        self.assertEqual(items(reopened.get_inventory("1")), {a: 3})
+        self.assertFalse(reopened.get_inventory("2"))
+        self.assertEqual(reopened.get_totals(), {"1": 3})
+        self.assertEqual(reopened.get_items(), {a})
+        self.assertEqual(reopened.cards.path(b), "img/10/b.jpg")
+
+    def test_move_items(self):
+        store = self.open()
+        old, new, gone = (store.cards.id(f"img/10/{name}.jpg") for name in ("old", "new", "gone"))
+        store.add_item("1", old, 2)
+        store.add_item("1", new, 1)
+        store.add_item("1", gone, 5)
+        self.assertEqual(store.move_items("1", {old: new, gone: None}), 5)
+        self.assertEqual(store.move_items("2", {old: new}), 0)
+        self.assertEqual(items(self.open().get_inventory("1")), {new: 3})
+
+    def test_move_items_everywhere(self):
+        store = self.open()
+        old, new, gone, kept = (store.cards.id(f"img/10/{name}.jpg") for name in ("old", "new", "gone", "kept"))
+        store.add_item("1", old, 2)
+        store.add_item("1", new, 1)
+        store.add_item("2", old, 1)
+        store.add_item("2", gone, 4)
+        store.add_item("3", gone, 1)
+        store.add_item("4", kept, 1)
+        moves = {old: new, gone: None}
+
+        self.assertEqual(store.move_items_everywhere(moves, ["2", "4"]), {"2": 4})
+        self.assertEqual(items(store.get_inventory("1")), {old: 2, new: 1})
+        self.assertEqual(store.move_items_everywhere(moves), {"1": 0, "3": 1})
+
+        reopened = self.open()
+        self.assertEqual(reopened.get_totals(), {"1": 3, "2": 1, "4": 1})
+        self.assertEqual(items(reopened.get_inventory("1")), {new: 3})
+        self.assertEqual(items(reopened.get_inventory("2")), {new: 1})
+        self.assertEqual(reopened.move_items_everywhere(moves), {})
+
+    def test_media(self):
+        store = self.open()
+        card_id = store.cards.id("img/10/a.jpg")
+        store.set_media(card_id, "https://cdn/a.jpg", 100.0)
+        self.assertEqual(self.open().get_media(), {card_id: ("https://cdn/a.jpg", 100.0)})
+        store.remove_media(card_id)
+        self.assertEqual(self.open().get_media(), {})
+
+
+class JSONStorageTest(BackendTests, unittest.TestCase):
+
+    FILENAME = "data.json"
+
+    def setUp(self):
+        super().setUp()
+        with open(self.filename, "w") as f:
+            f.write("{}")
+
+    def open(self):
+        store = storage.JSONStorage(self.filename, durability="sync")
+        self.stores.append(store)
+        return store
+
+
+class SQLiteStorageTest(BackendTests, unittest.TestCase):
+
+    FILENAME = "data.db"
+
+    def open(self):
+        store = storage.SQLiteStorage(self.filename)
+        self.stores.append(store)
+        return store
+
+    def test_questions_fold_beyond_ascii(self):
+        store = self.open()
+        store.add_question("ÉCOLE?", "a")
+        store.add_question("école?", "b")
+        # the oldest row with the same folded question and answer goes
+        self.assertFalse(store.remove_question({"question": "école?", "answer": "c"}))
+        self.assertTrue(store.remove_question({"question": "école?", "answer": "b"}))
+        self.assertEqual(store.get_questions(), [{"question": "ÉCOLE?", "answer": "a"}])
+
+    def test_changes_reach_other_connections(self):
+        store, other = self.open(), self.open()
+        self.assertIsNone(other.poll_changes())
+        card_id = store.cards.id("img/10/a.jpg")
+        store.add_item("1", card_id)
+        store.set_setting('frequency', [1, 2])
+        store.add_question("q", "a")
+
+        sections, users = other.poll_changes()
+        self.assertEqual(sections, {"settings", "questions", "cards"})
+        self.assertEqual(users, {"1"})
+        self.assertEqual(other.cards.path(card_id), "img/10/a.jpg")
+        self.assertIsNone(other.poll_changes())
+
+        store.move_items_everywhere({card_id: None})
+        self.assertEqual(other.poll_changes(), (set(), {"1"}))
+
+    def test_old_database_gets_folded_column(self):
+        conn = sqlite3.connect(self.filename)
+        conn.executescript("""
+            CREATE TABLE questions (id INTEGER PRIMARY KEY, question TEXT NOT NULL, answer TEXT NOT NULL);
+            CREATE INDEX questions_question ON questions (question COLLATE NOCASE);
+            INSERT INTO questions (question, answer) VALUES ('ÉCOLE?', 'a');
+        """)
+        conn.close()
+        self.assertTrue(self.open().remove_question({"question": "école?", "answer": "a"}))
+
+
+class MigrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="collector-test-")
+        self.json_file = os.path.join(self.directory, "data.json")
+        self.sqlite_file = os.path.join(self.directory, "data.db")
+        with open(self.json_file, "w") as f:
+            json.dump({
+                "settings": {"frequency": [1, 2]},
+                "quotes": [{"question": "q1", "answer": "a1"}, {"question": "q2", "answer": "a2"}],
+                "whitelist": [7],
+                "cards": ["img/10/a.jpg", "img/5/b.jpg"],
+                "users": {"1": [0, 1, 2, 1], "2": [1, 3]},
+                "media": {"1": ["https://cdn/b.jpg", 100.0]},
+            }, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_migrate(self):
+        self.assertTrue(storage.migrate(self.json_file, self.sqlite_file))
+        store = storage.SQLiteStorage(self.sqlite_file)
+        try:
+            self.assertEqual(store.get_setting('frequency'), [1, 2])
+            self.assertEqual(store.get_questions(), [{"question": "q1", "answer": "a1"},
+                                                     {"question": "q2", "answer": "a2"}])
+            self.assertEqual(store.get_whitelist(), [7])
+            users = dict((userid, dict((store.cards.path(card_id), amount) for card_id, amount in inventory.items()))
+                         for userid, inventory in store.get_users().items())
+            self.assertEqual(users, {"1": {"img/10/a.jpg": 2, "img/5/b.jpg": 1}, "2": {"img/5/b.jpg": 3}})
+            self.assertEqual(store.get_media(), {store.cards.id("img/5/b.jpg"): ("https://cdn/b.jpg", 100.0)})
+            # the import itself is not reported as a change to other processes
+            self.assertEqual(store.conn.execute("SELECT count(*) FROM inventory_changes").fetchone()[0], 0)
+        finally:
+            store.close()
+
+    def test_refuses_to_migrate_twice(self):
+        self.assertTrue(storage.migrate(self.json_file, self.sqlite_file))
+        self.assertFalse(storage.migrate(self.json_file, self.sqlite_file))
+        store = storage.SQLiteStorage(self.sqlite_file)
+        try:
+            self.assertEqual(store.get_totals(), {"1": 3, "2": 3})
+            self.assertEqual(len(store.get_questions()), 2)
+        finally:
+            store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
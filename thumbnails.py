@@ -0,0 +1,192 @@
+# Author : Joinemm
+# File   : thumbnails.py
+
+import asyncio
+import collections
+import concurrent.futures
+import io
+import os
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+THUMB_ROOT = "thumbs"
+# thumbnails fit inside this box and are re-encoded at lower quality until under THUMB_BYTES
+THUMB_SIZE = (256, 256)
+THUMB_BYTES = 64 * 1024
+# size of one cell in the collection mosaic
+TILE_SIZE = 128
+MOSAIC_COLUMNS = 10
+MAX_TILES = 100
+# users whose rendered mosaic is kept in memory
+MAX_CACHED = 100
+WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+
+def thumbnail_path(path, image_root, thumb_root=THUMB_ROOT):
+    """img/10/hye.png -> thumbs/10/hye.jpg"""
+    relative = os.path.relpath(path, image_root)
+    return os.path.join(thumb_root, os.path.splitext(relative)[0] + ".jpg")
+
+
+def outdated(paths, image_root, thumb_root=THUMB_ROOT):
+    """:returns [(source, thumbnail)] of every image whose thumbnail is missing or older than it"""
+    jobs = []
+    for path in paths:
+        target = thumbnail_path(path, image_root, thumb_root)
+        try:
+            if os.stat(target).st_mtime >= os.stat(path).st_mtime:
+                continue
+        except FileNotFoundError:
+            pass
+        jobs.append((path, target))
+    return jobs
+
+
+def make_thumbnail(source, target, size=THUMB_SIZE, max_bytes=THUMB_BYTES):
+    """Downscale one image into a jpeg no larger than max_bytes. Runs in a worker process."""
+    with Image.open(source) as image:
+        image = image.convert("RGB")
+        image.thumbnail(size)
+    for quality in (85, 75, 60, 45, 30):
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            break
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # a unique temp file, so a half written one never replaces a thumbnail that looks up to date
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temp_path, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return target
+
+
+def render_mosaic(thumbs, columns=MOSAIC_COLUMNS, tile=TILE_SIZE):
+    """Paste thumbnails into one grid image. Runs in a worker process.
+    :returns jpeg bytes"""
+    columns = min(columns, len(thumbs))
+    rows = -(-len(thumbs) // columns)
+    mosaic = Image.new("RGB", (columns * tile, rows * tile), (47, 49, 54))
+    for i, path in enumerate(thumbs):
+        try:
+            with Image.open(path) as image:
+                image = image.convert("RGB")
+                image.thumbnail((tile, tile))
+        except OSError:
+            continue
+        x = (i % columns) * tile + (tile - image.width) // 2
+        y = (i // columns) * tile + (tile - image.height) // 2
+        mosaic.paste(image, (x, y))
+    buffer = io.BytesIO()
+    mosaic.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+
+class Thumbnails:
+    """Keeps a downscaled copy of every catalog image under THUMB_ROOT, and renders
+    collection mosaics from them. All image work runs in a process pool."""
+
+    def __init__(self, catalog, thumb_root=THUMB_ROOT, workers=WORKERS):
+        self.catalog = catalog
+        self.thumb_root = thumb_root
+        self.workers = workers
+        self.pool = None
+        self.version = None
+        # userid -> (inventory version, jpeg bytes)
+        self.mosaics = collections.OrderedDict()
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def _pool(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def path(self, image):
+        """:returns thumbnail path of an image, or None if it has not been made yet"""
+        target = thumbnail_path(image, self.catalog.root, self.thumb_root)
+        return target if os.path.exists(target) else None
+
+    async def sync(self):
+        """Create the thumbnails that are missing or older than their image
+        :returns how many were made"""
+        loop = asyncio.get_event_loop()
+        version = self.catalog.version
+        jobs = await loop.run_in_executor(None, outdated, self.catalog.paths, self.catalog.root, self.thumb_root)
+        if not jobs:
+            self.version = version
+            return 0
+        pool = self._pool()
+        results = await asyncio.gather(*(loop.run_in_executor(pool, make_thumbnail, source, target)
+                                         for source, target in jobs), return_exceptions=True)
+        made = 0
+        broken = False
+        for (source, _), result in zip(jobs, results):
+            if isinstance(result, concurrent.futures.BrokenExecutor):
+                broken = True
+            elif isinstance(result, Exception):
+                print(f"Thumbnail of {source} failed [{result}]")
+            else:
+                made += 1
+        print(f"Made {made} thumbnails")
+        if broken:
+            # a broken pool fails every later job, start a new one and retry on the next pass
+            self.close()
+            raise concurrent.futures.BrokenExecutor("a thumbnail worker died")
+        self.version = version
+        return made
+
+    async def run(self):
+        """Background task making every thumbnail on startup, then new ones when the catalog changes"""
+        if not self.available:
+            print("Pillow is not installed, thumbnails disabled")
+            return
+        while True:
+            self.catalog.check()
+            if self.catalog.version != self.version:
+                try:
+                    await self.sync()
+                except Exception as e:
+                    # the version stays behind, so the next pass tries again
+                    print(f"Making thumbnails failed [{e}]")
+            await asyncio.sleep(self.catalog.refresh_interval)
+
+    async def mosaic(self, userid, version, images):
+        """Grid image of the thumbnails of [images], cached until the inventory version changes
+        unless some thumbnails were still missing
+        :returns jpeg bytes, or None if none of the images have a thumbnail yet"""
+        cached = self.mosaics.get(userid)
+        if cached is not None and cached[0] == version:
+            self.mosaics.move_to_end(userid)
+            return cached[1]
+
+        found = list(map(self.path, images[:MAX_TILES]))
+        thumbs = [thumb for thumb in found if thumb is not None]
+        if not thumbs:
+            return None
+        data = await asyncio.get_event_loop().run_in_executor(self._pool(), render_mosaic, thumbs)
+        if len(thumbs) < len(found):
+            # thumbnails are still being made, render the full grid next time
+            self.mosaics.pop(userid, None)
+            return data
+        self.mosaics[userid] = (version, data)
+        self.mosaics.move_to_end(userid)
+        while len(self.mosaics) > MAX_CACHED:
+            self.mosaics.popitem(last=False)
+        return data
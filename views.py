@@ -0,0 +1,68 @@
+# Author : Joinemm
+# File   : views.py
+
+import collections
+from operator import itemgetter
+
+from catalog import card_name
+
+
+# users whose inventory views are kept cached
+MAX_CACHED = 1000
+
+
+class InventoryView:
+    """Display rows of one inventory snapshot. Each sort order is computed once
+    and pages are only rendered when asked for."""
+
+    ORDERS = {
+        'name': (lambda entry: entry[0].lower(), False),
+        'count': (itemgetter(1), True),
+    }
+
+    __slots__ = ('version', 'entries', 'total', 'orders')
+
+    def __init__(self, inventory, cards, version):
+        self.version = version
+        self.entries = [(card_name(cards.path(card_id)), qty) for card_id, qty in inventory.items()]
+        self.total = sum(qty for _, qty in self.entries)
+        self.orders = {None: self.entries}
+
+    def sorted(self, order=None):
+        entries = self.orders.get(order)
+        if entries is None:
+            key, reverse = self.ORDERS[order]
+            entries = sorted(self.entries, key=key, reverse=reverse)
+            self.orders[order] = entries
+        return entries
+
+    def page_count(self, per_page):
+        return -(-len(self.entries) // per_page)
+
+    def render(self, page, per_page, order=None):
+        start = page * per_page
+        return "\n".join(f"{name} : **{qty}**" for name, qty in self.sorted(order)[start:start + per_page])
+
+
+class InventoryViews:
+    """Cached InventoryView per user, rebuilt when the user's inventory version changes"""
+
+    def __init__(self, database, max_cached=MAX_CACHED):
+        self.database = database
+        self.max_cached = max_cached
+        self.views = collections.OrderedDict()
+
+    def get(self, user):
+        userid = str(user.id)
+        view = self.views.get(userid)
+        if view is not None and view.version == self.database.inventory_version(userid):
+            self.views.move_to_end(userid)
+            return view
+
+        inventory = self.database.get_inventory(user)
+        view = InventoryView(inventory, self.database.cards, self.database.inventory_version(userid))
+        self.views[userid] = view
+        self.views.move_to_end(userid)
+        while len(self.views) > self.max_cached:
+            self.views.popitem(last=False)
+        return view